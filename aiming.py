@@ -0,0 +1,165 @@
+"""
+The aiming preview: the dots that show the path the duck will fly when it is
+launched with the current angle and force.
+
+The path only depends on the angle and the force, so the offsets of the
+dots from the duck are computed once for a table of angles and forces (the
+steps the arrow keys use) and looked up while aiming. Dragging with the
+mouse gives angles and forces between the steps, which are interpolated
+from the four nearest trajectories in the table.
+
+The preview is cut where the duck would first hit an obstacle or the
+ground, found with the world's spatial grid. Targets don't cut it, since
+the duck flies through them.
+"""
+import math
+import physics
+import spatial
+from entities import Duck
+
+# The steps of the table, same as the arrow keys use
+ANGLE_STEP = 5
+FORCE_STEP = 5
+MAX_FORCE = 100
+# The number of points in a trajectory
+POINTS = 15
+
+
+def create_table(points=POINTS, angle_step=ANGLE_STEP, force_step=FORCE_STEP, max_force=MAX_FORCE):
+    """
+    Computes the trajectories of the launch angles from -180 to 180 degrees
+    and the forces from 0 to max_force, and returns them as a table. A
+    trajectory is a list of the duck's offsets from the launch position
+    after each time step, starting from (0, 0).
+
+    :Parameters:
+        `points` : int
+            The number of points in a trajectory.
+        `angle_step` : float
+            The difference in degrees between two angles in the table.
+        `force_step` : float
+            The difference between two forces in the table.
+        `max_force` : float
+            The largest force in the table.
+    """
+    angles = int(360 // angle_step) + 1
+    forces = int(max_force // force_step) + 1
+    trajectories = []
+    for row in range(angles):
+        angle = math.radians(-180 + row * angle_step)
+        for column in range(forces):
+            velocity = column * force_step * physics.FORCE_FACTOR
+            x_velocity = velocity * math.cos(angle)
+            y_velocity = velocity * math.sin(angle)
+            x = y = 0.0
+            offsets = []
+            for _ in range(points):
+                offsets.append((x, y))
+                x += x_velocity
+                y += y_velocity
+                y_velocity -= physics.GRAVITATIONAL_ACCEL
+            trajectories.append(offsets)
+    return {
+        "angle_step": angle_step,
+        "force_step": force_step,
+        "angles": angles,
+        "forces": forces,
+        "trajectories": trajectories
+    }
+
+
+def table_position(value, step, count):
+    """
+    Returns the indices of the two table entries around a value and the
+    weight of the second one. Values outside the table are clamped to it.
+    """
+    position = min(max(value / step, 0), count - 1)
+    first = int(position)
+    return first, min(first + 1, count - 1), position - first
+
+
+def trajectory(table, angle, force):
+    """
+    Returns the offsets of the duck from the launch position after each time
+    step when it is launched with the given angle and force. Angles and
+    forces between the table's steps are interpolated.
+
+    :Parameters:
+        `table` : A `dict` created with `create_table`.
+        `angle` : float
+            The launch angle in degrees, from -180 to 180.
+        `force` : float
+            The launch force.
+    """
+    row, next_row, row_weight = table_position(angle + 180, table["angle_step"], table["angles"])
+    column, next_column, column_weight = table_position(force, table["force_step"], table["forces"])
+    forces = table["forces"]
+    trajectories = table["trajectories"]
+    if not row_weight and not column_weight:
+        return trajectories[row * forces + column]
+    weighted = [
+        (trajectories[row * forces + column], (1 - row_weight) * (1 - column_weight)),
+        (trajectories[row * forces + next_column], (1 - row_weight) * column_weight),
+        (trajectories[next_row * forces + column], row_weight * (1 - column_weight)),
+        (trajectories[next_row * forces + next_column], row_weight * column_weight)
+    ]
+    return [(sum(points[i][0] * weight for points, weight in weighted),
+             sum(points[i][1] * weight for points, weight in weighted))
+            for i in range(len(weighted[0][0]))]
+
+
+def first_impact(world, duck, x_movement, y_movement):
+    """
+    Returns the fraction of the movement after which the duck hits an
+    obstacle or the ground, or `None` if it doesn't hit anything.
+
+    :Parameters:
+        `world` : A `dict` created with physics.create_world.
+        `duck` : A `Duck` at the start of the movement.
+        `x_movement` : float
+            The movement along the x axis.
+        `y_movement` : float
+            The movement along the y axis.
+    """
+    impact = None
+    if duck.y + y_movement <= physics.GROUND_LEVEL < duck.y:
+        impact = (duck.y - physics.GROUND_LEVEL) / -y_movement
+    for box in spatial.query(world["grid"],
+                             duck.x + min(x_movement, 0),
+                             duck.x + duck.w + max(x_movement, 0),
+                             duck.y + min(y_movement, 0),
+                             duck.y + duck.h + max(y_movement, 0)):
+        if box.type != "obstacle":
+            continue
+        hit = physics.time_of_impact(duck, x_movement, y_movement, box)
+        if hit is not None and (impact is None or hit[0] < impact):
+            impact = hit[0]
+    return impact
+
+
+def preview(table, world):
+    """
+    Returns the positions of the preview dots for the world's duck with the
+    world's angle and force: the duck's positions after each time step, cut
+    at the first obstacle or the ground it hits. The last position is then
+    where the duck hits.
+
+    :Parameters:
+        `table` : A `dict` created with `create_table`.
+        `world` : A `dict` created with physics.create_world.
+    """
+    duck = world["duck"]
+    offsets = trajectory(table, world["angle"], world["force"])
+    probe = Duck(duck.x, duck.y, duck.w, duck.h)
+    positions = [(duck.x, duck.y)]
+    for (x, y), (next_x, next_y) in zip(offsets, offsets[1:]):
+        probe.x = duck.x + x
+        probe.y = duck.y + y
+        x_movement = next_x - x
+        y_movement = next_y - y
+        impact = first_impact(world, probe, x_movement, y_movement)
+        if impact is not None:
+            positions.append((probe.x + x_movement * impact, probe.y + y_movement * impact))
+            break
+        positions.append((duck.x + next_x, duck.y + next_y))
+    return positions
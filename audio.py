@@ -0,0 +1,161 @@
+"""
+A sound effect mixer: sounds queued during the physics steps are played once
+per frame on a fixed pool of voices, each sound limited to a few at a time.
+"""
+import time
+
+# The number of sounds that can play at the same time
+VOICES = 8
+
+
+def null_backend():
+    """
+    Returns a backend that doesn't play anything, for running without an
+    audio device. A mixer with it ignores queued sounds.
+    """
+    return {
+        "enabled": False,
+        "load": lambda path: None,
+        "duration": lambda sound: 0.0,
+        "create_voice": lambda: None,
+        "play": lambda voice, sound: None
+    }
+
+
+def pyglet_backend():
+    """Returns a backend that plays the sounds with pyglet's media players."""
+    import pyglet
+
+    def play(player, sound):
+        player.pause()
+        if player.source is not None:
+            player.next_source()
+        player.queue(sound)
+        player.play()
+
+    return {
+        "enabled": True,
+        "load": lambda path: pyglet.media.load(path, streaming=False),
+        "duration": lambda sound: sound.duration or 0.0,
+        "create_voice": pyglet.media.Player,
+        "play": play
+    }
+
+
+def create_mixer(backend=None, voices=VOICES, clock=time.perf_counter):
+    """
+    Creates a mixer and its voices. The voices are created once and reused
+    for every sound played, so playing a sound never creates a new player.
+
+    :Parameters:
+        `backend` : A `dict` created with `pyglet_backend` or `null_backend`.
+                    Defaults to the null backend.
+        `voices` : int
+            The number of sounds that can play at the same time.
+        `clock` : A function that returns the current time in seconds.
+    """
+    if backend is None:
+        backend = null_backend()
+    return {
+        "backend": backend,
+        "clock": clock,
+        "sounds": {},
+        "voices": [{
+            "player": backend["create_voice"](),
+            "sound": None,
+            "busy_until": 0.0
+        } for _ in range(voices)],
+        "pending": {},
+        "played": 0,
+        "coalesced": 0,
+        "dropped": 0
+    }
+
+
+def load(mixer, name, path, limit=None):
+    """
+    Loads a sound into the mixer.
+
+    :Parameters:
+        `mixer` : A `dict` created with `create_mixer`.
+        `name` : str
+            The name the sound is queued with.
+        `path` : str
+            Path to the sound file.
+        `limit` : int
+            The most voices the sound can play on at the same time.
+            Unlimited by default.
+    """
+    backend = mixer["backend"]
+    sound = backend["load"](path)
+    mixer["sounds"][name] = {
+        "sound": sound,
+        "duration": backend["duration"](sound),
+        "limit": limit
+    }
+
+
+def queue(mixer, name):
+    """
+    Asks for a sound to be played at the next `dispatch`.
+
+    :Parameters:
+        `mixer` : A `dict` created with `create_mixer`.
+        `name` : str
+            The name of a loaded sound.
+    """
+    if not mixer["backend"]["enabled"]:
+        return
+    pending = mixer["pending"]
+    pending[name] = pending.get(name, 0) + 1
+
+
+def dispatch(mixer):
+    """
+    Plays the sounds queued since the previous dispatch, each once, however
+    many times it was queued, on voices that aren't playing anything. A
+    sound is dropped when there is no free voice or the sound already plays
+    on as many voices as its limit allows.
+
+    :Parameters:
+        `mixer` : A `dict` created with `create_mixer`.
+    """
+    if not mixer["pending"]:
+        return
+    now = mixer["clock"]()
+    backend = mixer["backend"]
+    for name, count in mixer["pending"].items():
+        mixer["coalesced"] += count - 1
+        sound = mixer["sounds"][name]
+        free = None
+        playing = 0
+        for voice in mixer["voices"]:
+            if voice["busy_until"] <= now:
+                if free is None:
+                    free = voice
+            elif voice["sound"] == name:
+                playing += 1
+        if free is None or sound["limit"] is not None and playing >= sound["limit"]:
+            mixer["dropped"] += 1
+            continue
+        backend["play"](free["player"], sound["sound"])
+        free["sound"] = name
+        free["busy_until"] = now + sound["duration"]
+        mixer["played"] += 1
+    mixer["pending"] = {}
+
+
+def stats(mixer):
+    """
+    Returns a dictionary with the number of sounds played, the number of
+    requests coalesced into another request and the number of sounds
+    dropped for lack of a voice.
+
+    :Parameters:
+        `mixer` : A `dict` created with `create_mixer`.
+    """
+    return {
+        "played": mixer["played"],
+        "coalesced": mixer["coalesced"],
+        "dropped": mixer["dropped"]
+    }
@@ -0,0 +1,329 @@
+"""
+Flies all the shots of a level at once with NumPy, against boxes that stay in
+place, e.g. `python batchsim.py level1.json --compare`. Requires NumPy.
+"""
+import argparse
+import math
+import time
+import numpy
+import physics
+import solver
+
+# How many duck-box pairs are compared in one go. Limits the size of the
+# temporary arrays.
+CHUNK_SIZE = 1 << 18
+
+
+def level_arrays(world):
+    """
+    Returns the boxes of a world as a dictionary of arrays: x, y, w, h,
+    "target" (True for targets) and "index" (the box's index in the level),
+    and "bounds", the minimum and maximum x and y of the area the boxes
+    cover.
+
+    :Parameters:
+        `world` : A `dict` created with physics.create_world, preferably with
+                  settled boxes, e.g. from solver.settle.
+    """
+    boxes = world["boxes"]
+    arrays = {
+        "x": numpy.array([box.x for box in boxes], dtype=float),
+        "y": numpy.array([box.y for box in boxes], dtype=float),
+        "w": numpy.array([box.w for box in boxes], dtype=float),
+        "h": numpy.array([box.h for box in boxes], dtype=float),
+        "target": numpy.array([box.type == "target" for box in boxes], dtype=bool),
+        "index": numpy.array([box.index for box in boxes], dtype=int)
+    }
+    if boxes:
+        arrays["bounds"] = (arrays["x"].min(),
+                            (arrays["x"] + arrays["w"]).max(),
+                            arrays["y"].min(),
+                            (arrays["y"] + arrays["h"]).max())
+    else:
+        arrays["bounds"] = (numpy.inf, -numpy.inf, numpy.inf, -numpy.inf)
+    return arrays
+
+
+def launch_state(world, shots):
+    """
+    Returns the starting positions and velocities of the shots as a
+    dictionary of arrays, computed the same way as physics.update_position
+    and physics.launch compute them.
+
+    :Parameters:
+        `world` : A `dict` created with physics.create_world.
+        `shots` : A `list` of (angle, force) pairs.
+    """
+    columns = []
+    for angle, force in shots:
+        x, y = physics.convert_to_xy(math.radians(angle), force)
+        columns.append((physics.LAUNCH_X - x,
+                        physics.LAUNCH_Y - y,
+                        force * physics.FORCE_FACTOR * math.cos(math.radians(angle)),
+                        force * physics.FORCE_FACTOR * math.sin(math.radians(angle))))
+    x, y, x_velocity, y_velocity = numpy.array(columns, dtype=float).reshape(-1, 4).T
+    count = len(shots)
+    return {
+        "shot": numpy.arange(count),
+        "x": x.copy(),
+        "y": y.copy(),
+        "x_velocity": x_velocity.copy(),
+        "y_velocity": y_velocity.copy(),
+        "slow": numpy.zeros(count),
+        "w": world["duck"].w,
+        "h": world["duck"].h
+    }
+
+
+def sweep_axis(position, movement, box_min, box_max):
+    """
+    Same as physics.sweep_axis for arrays: returns arrays of the times at
+    which the points enter and exit the ranges.
+    """
+    still = movement == 0
+    moving = numpy.where(still, 1.0, movement)
+    first = (box_min - position) / moving
+    second = (box_max - position) / moving
+    entry = numpy.minimum(first, second)
+    exit_ = numpy.maximum(first, second)
+    inside = (box_min < position) & (position < box_max)
+    entry = numpy.where(still, numpy.where(inside, -numpy.inf, numpy.inf), entry)
+    exit_ = numpy.where(still, numpy.where(inside, numpy.inf, -numpy.inf), exit_)
+    return entry, exit_
+
+
+def record_hits(hits, first_hit, shots, boxes_hit, times, step):
+    """
+    Records the boxes that the ducks of the given shots touched this step.
+    `boxes_hit` is a boolean matrix of shots and boxes, and `times` the time
+    of each touch (used for finding the first box a shot touches).
+    """
+    rows, columns = numpy.nonzero(boxes_hit)
+    if not len(rows):
+        return
+    new = hits[shots[rows], columns] < 0
+    hits[shots[rows[new]], columns[new]] = step
+    touched = boxes_hit.any(axis=1)
+    unhit = touched & (first_hit[shots] < 0)
+    if unhit.any():
+        earliest = numpy.where(boxes_hit[unhit], times[unhit], numpy.inf).argmin(axis=1)
+        first_hit[shots[unhit]] = earliest
+
+
+def fly(state, boxes, hits, first_hit, step, dt, max_bounces):
+    """
+    Moves the ducks of the state by one time step, see physics.fly_duck.
+    The state's arrays are updated in place.
+    """
+    x = state["x"]
+    y = state["y"]
+    x_velocity = state["x_velocity"]
+    y_velocity = state["y_velocity"]
+    w = state["w"]
+    h = state["h"]
+    shots = state["shot"]
+
+    # Ducks whose path this step stays clear of the area of the boxes just
+    # move, the others are swept through the boxes
+    remaining = numpy.full(len(x), dt * physics.TICK_RATE)
+    x_movement = x_velocity * remaining
+    y_movement = y_velocity * remaining
+    min_x, max_x, min_y, max_y = boxes["bounds"]
+    near = ((x + numpy.minimum(x_movement, 0) <= max_x) &
+            (x + w + numpy.maximum(x_movement, 0) >= min_x) &
+            (y + numpy.minimum(y_movement, 0) <= max_y) &
+            (y + h + numpy.maximum(y_movement, 0) >= min_y))
+    x[~near] += x_movement[~near] * 1.0
+    y[~near] += y_movement[~near] * 1.0
+    moving = numpy.flatnonzero(near)
+
+    # Targets the ducks are touching, see physics.destroy_targets
+    touching = ((boxes["y"] <= y[moving, None] + h) &
+                (boxes["y"] + boxes["h"] >= y[moving, None]) &
+                (boxes["x"] <= x[moving, None] + w) &
+                (boxes["x"] + boxes["w"] >= x[moving, None]))
+    touching &= boxes["target"]
+    record_hits(hits, first_hit, shots[moving], touching, numpy.zeros(touching.shape), step)
+
+    # Sweep through the boxes, see physics.move_duck
+    for _ in range(max_bounces + 1):
+        if not len(moving):
+            break
+        x_movement = x_velocity[moving] * remaining[moving]
+        y_movement = y_velocity[moving] * remaining[moving]
+        x_entry, x_exit = sweep_axis(x[moving, None],
+                                     x_movement[:, None],
+                                     boxes["x"] - w,
+                                     boxes["x"] + boxes["w"])
+        y_entry, y_exit = sweep_axis(y[moving, None],
+                                     y_movement[:, None],
+                                     boxes["y"] - h,
+                                     boxes["y"] + boxes["h"])
+        entry = numpy.maximum(x_entry, y_entry)
+        valid = (entry < numpy.minimum(x_exit, y_exit)) & (entry >= 0) & (entry <= 1)
+
+        obstacle_entry = numpy.where(valid & ~boxes["target"], entry, numpy.inf)
+        contact = obstacle_entry.argmin(axis=1)
+        rows = numpy.arange(len(moving))
+        contact_time = obstacle_entry[rows, contact]
+        bounced = contact_time < numpy.inf
+        time_ = numpy.where(bounced, contact_time, 1.0)
+
+        passed = valid & (entry <= time_[:, None]) & boxes["target"]
+        passed[rows[bounced], contact[bounced]] = True
+        record_hits(hits, first_hit, shots[moving], passed, entry, step)
+
+        x[moving] += x_movement * time_
+        y[moving] += y_movement * time_
+        if not bounced.any():
+            break
+
+        # Bounce off the side that was hit, see physics.bounce
+        moving = moving[bounced]
+        box = contact[bounced]
+        x_movement = x_movement[bounced]
+        y_movement = y_movement[bounced]
+        side_x = x_entry[rows[bounced], box] > y_entry[rows[bounced], box]
+        normal_x = numpy.where(side_x, -numpy.copysign(1, x_movement), 0)
+        normal_y = numpy.where(side_x, 0, -numpy.copysign(1, y_movement))
+        x[moving] = numpy.where(normal_x > 0, boxes["x"][box] + boxes["w"][box],
+                                numpy.where(normal_x < 0, boxes["x"][box] - w, x[moving]))
+        y[moving] = numpy.where(normal_y > 0, boxes["y"][box] + boxes["h"][box],
+                                numpy.where(normal_y < 0, boxes["y"][box] - h, y[moving]))
+        flip_x = (normal_x != 0) & (x_velocity[moving] * normal_x < 0)
+        x_velocity[moving] = numpy.where(flip_x, x_velocity[moving] * -physics.ELASTICITY,
+                                         x_velocity[moving])
+        flip_y = (normal_y != 0) & (y_velocity[moving] * normal_y < 0)
+        y_velocity[moving] = numpy.where(flip_y, y_velocity[moving] * -physics.ELASTICITY,
+                                         y_velocity[moving])
+        x_velocity[moving] = numpy.where(flip_y, x_velocity[moving] * physics.ELASTICITY,
+                                         x_velocity[moving])
+        remaining[moving] *= 1 - time_[bounced]
+
+    y_velocity -= physics.GRAVITATIONAL_ACCEL * dt * physics.TICK_RATE
+    slow = (numpy.abs(x_velocity) <= 1.5) & (numpy.abs(y_velocity) <= 2.5)
+    state["slow"] = numpy.where(slow, state["slow"] + dt, 0)
+
+
+def simulate(world, shots, max_steps=solver.MAX_STEPS, dt=physics.TIME_STEP, max_bounces=4):
+    """
+    Flies the given shots in the world in lockstep and returns a list of
+    result dictionaries in the same order as the shots, with the same keys
+    as the results of solver.simulate_shot, except rest_steps, and the
+    following additional keys:
+    first_hit: index of the first box the shot touches, or None
+    x, y: where the duck ended up
+
+    The destroyed targets are listed in the order they were hit, and
+    targets hit during the same step in the order of their indices. The
+    world isn't modified.
+
+    Every duck still in flight is moved with the same array operations in
+    each step, and it's swept through the boxes like in physics.move_duck.
+    The boxes don't move: a destroyed target stays in place for the rest of
+    the shot, and the boxes on top of it don't fall. A shot ends when the
+    duck lands, so the targets the used duck would destroy while falling
+    into place aren't counted. Shots that don't knock boxes down or land on
+    targets end the same as in the solver.
+
+    :Parameters:
+        `world` : A `dict` created with physics.create_world, preferably with
+                  settled boxes, e.g. from solver.settle.
+        `shots` : A `list` of (angle, force) pairs.
+        `max_steps` : int
+            The most steps a duck can fly before its shot is cut short.
+        `dt` : float
+            The length of the time step in seconds.
+        `max_bounces` : int
+            The maximum number of bounces per time step.
+    """
+    boxes = level_arrays(world)
+    count = len(shots)
+    hits = numpy.full((count, len(boxes["x"])), -1, dtype=numpy.int32)
+    first_hit = numpy.full(count, -1)
+    steps = numpy.zeros(count, dtype=int)
+    end_x = numpy.zeros(count)
+    end_y = numpy.zeros(count)
+
+    state = launch_state(world, shots)
+    chunk = max(1, CHUNK_SIZE // max(len(boxes["x"]), 1))
+    step = 0
+    while len(state["shot"]) and step < max_steps:
+        step += 1
+        for start in range(0, len(state["shot"]), chunk):
+            part = {key: value[start:start + chunk] if isinstance(value, numpy.ndarray) else value
+                    for key, value in state.items()}
+            fly(part, boxes, hits, first_hit, step, dt, max_bounces)
+            state["slow"][start:start + chunk] = part["slow"]
+        landed = (state["y"] <= physics.GROUND_LEVEL) | (state["slow"] > 0.1)
+        if step == max_steps:
+            landed[:] = True
+        if landed.any():
+            retired = state["shot"][landed]
+            steps[retired] = step
+            end_x[retired] = state["x"][landed]
+            end_y[retired] = state["y"][landed]
+            for key, value in state.items():
+                if isinstance(value, numpy.ndarray):
+                    state[key] = value[~landed]
+
+    # The destroyed targets of all shots, sorted by shot, step and index
+    rows, columns = numpy.nonzero((hits >= 0) & boxes["target"])
+    order = numpy.lexsort((columns, hits[rows, columns], rows))
+    destroyed = boxes["index"][columns[order]].tolist()
+    ends = numpy.searchsorted(rows[order], numpy.arange(count + 1)).tolist()
+    targets = int(boxes["target"].sum())
+    first_index = numpy.where(first_hit >= 0, boxes["index"][first_hit], -1).tolist()
+    steps = steps.tolist()
+    end_x = end_x.tolist()
+    end_y = end_y.tolist()
+    results = []
+    for i, (angle, force) in enumerate(shots):
+        results.append({
+            "angle": angle,
+            "force": force,
+            "destroyed": destroyed[ends[i]:ends[i + 1]],
+            "cleared": ends[i + 1] - ends[i] == targets,
+            "steps": steps[i],
+            "first_hit": first_index[i] if first_index[i] >= 0 else None,
+            "x": end_x[i],
+            "y": end_y[i]
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Flies every keyboard shot of a level at once.")
+    parser.add_argument("level", nargs="?", help="a level file, e.g. level1.json")
+    parser.add_argument("--seed", type=int, default=0, help="seed for a random level")
+    parser.add_argument("--boxes", type=int, default=20, help="boxes in a random level")
+    parser.add_argument("--compare", action="store_true",
+                        help="also simulate the shots with the solver and compare")
+    args = parser.parse_args()
+
+    level_box_list = solver.level_boxes(args.level, args.seed, args.boxes)
+    settled = solver.settle(level_box_list)
+    candidate_shots = solver.candidate_shots()
+    batch_start = time.perf_counter()
+    batch_results = simulate(settled, candidate_shots)
+    elapsed = time.perf_counter() - batch_start
+    best = max(batch_results, key=lambda result: len(result["destroyed"]))
+    print("Best shot destroys {} targets: angle {}, force {}".format(
+        len(best["destroyed"]), best["angle"], best["force"]))
+    print("{} shots in {:.2f} s, {:.0f} shots/s".format(
+        len(candidate_shots), elapsed, len(candidate_shots) / elapsed))
+
+    if args.compare:
+        solver_start = time.perf_counter()
+        solver_results = [solver.simulate_shot(settled, angle, force)
+                          for angle, force in candidate_shots]
+        solver_elapsed = time.perf_counter() - solver_start
+        same = sum(1 for batch, scalar in zip(batch_results, solver_results)
+                   if batch["destroyed"] == scalar["destroyed"] and
+                   batch["steps"] == scalar["steps"])
+        same_targets = sum(1 for batch, scalar in zip(batch_results, solver_results)
+                           if sorted(batch["destroyed"]) == sorted(scalar["destroyed"]))
+        print("Solver: {:.2f} s, {:.0f} shots/s, {:.1f}x slower".format(
+            solver_elapsed, len(candidate_shots) / solver_elapsed, solver_elapsed / elapsed))
+        print("{} of {} shots identical to the solver, {} destroy the same targets".format(
+            same, len(candidate_shots), same_targets))
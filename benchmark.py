@@ -0,0 +1,547 @@
+"""
+Benchmarks for the simulation core. Run from the command line:
+
+    python benchmark.py
+    python benchmark.py --json results.json
+    python benchmark.py --compare baseline.json
+
+The default run times each function of the per-tick hot path separately and
+one whole game tick (what main.update does per physics step) over a range of
+box and used duck counts. The results can be saved as JSON and compared with
+a saved baseline: any benchmark that got slower by more than the threshold is
+reported as a regression, and the exit status is 1.
+
+`--scaling` prints the older scaling tables instead.
+
+The benchmarks use the headless physics module, so no window or audio device
+is needed.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import entities
+import levelfile
+import levels
+import physics
+import shotcache
+import solver
+
+try:
+    import boxstore
+except ImportError:
+    boxstore = None
+
+
+def create_stacks(quantity):
+    """
+    Creates a level with the given number of boxes arranged as stacks of
+    five, half of them targets and half obstacles. The stacks are spread to
+    the right so that the number of boxes near any point stays the same no
+    matter how many boxes there are.
+
+    :Parameters:
+        `quantity` : int
+            The number of boxes to create.
+    """
+    boxes = []
+    for i in range(quantity):
+        boxes.append({
+            "type": "target" if i % 2 else "obstacle",
+            "x": 400 + (i // 5) * 80,
+            "y": physics.GROUND_LEVEL + (i % 5) * 40,
+            "w": 40,
+            "h": 40,
+            "vy": 0
+        })
+    return boxes
+
+
+def time_collision_queries(quantity, ticks=500):
+    """
+    Returns the average time in milliseconds that one tick's collision
+    queries take in a level with the given number of boxes. The duck is
+    kept in the same place above the first stacks with 16 used ducks
+    resting on the ground, so only the number of boxes changes.
+
+    :Parameters:
+        `quantity` : int
+            The number of boxes in the level.
+        `ticks` : int
+            The number of ticks to time.
+    """
+    world = physics.create_world(create_stacks(quantity))
+    for i in range(16):
+        physics.add_used_duck(world, entities.Duck(200 + i * 10, physics.GROUND_LEVEL))
+    start = time.perf_counter()
+    for _ in range(ticks):
+        put_duck(world, 420, 300, 20, -20)
+        physics.drop_ducks(world)
+        physics.destroy_targets(world, world["duck"])
+        physics.check_overlaps(world)
+        physics.move_duck(world)
+    return (time.perf_counter() - start) / ticks * 1000
+
+
+def time_drop_boxes(quantity, ticks=500):
+    """
+    Returns the average time in milliseconds that drop_boxes takes per tick
+    in a random level with the given number of boxes: first while the boxes
+    are falling into place and then once they have settled.
+
+    :Parameters:
+        `quantity` : int
+            The number of boxes in the level.
+        `ticks` : int
+            The number of ticks to time once the boxes have settled.
+    """
+    random.seed(quantity)
+    world = physics.create_world(physics.create_boxes(quantity))
+    falling_ticks = 0
+    start = time.perf_counter()
+    while world["awake_boxes"]:
+        physics.drop_boxes(world)
+        falling_ticks += 1
+    falling = (time.perf_counter() - start) / falling_ticks * 1000
+    start = time.perf_counter()
+    for _ in range(ticks):
+        physics.drop_boxes(world)
+    settled = (time.perf_counter() - start) / ticks * 1000
+    return falling, settled
+
+
+def time_box_store(quantity, ticks=1000):
+    """
+    Returns the average time in milliseconds that one tick takes with the
+    NumPy box store: dropping the boxes, finding the boxes in the duck's
+    path and destroying the targets it overlaps. The boxes are settled
+    before timing.
+
+    :Parameters:
+        `quantity` : int
+            The number of boxes in the level.
+        `ticks` : int
+            The number of ticks to time.
+    """
+    store = boxstore.from_boxes(create_stacks(quantity))
+    while (store["alive"] & ~store["settled"]).any():
+        boxstore.drop(store)
+    duck = entities.Duck(420, 300, x_velocity=20, y_velocity=-20)
+    start = time.perf_counter()
+    for _ in range(ticks):
+        boxstore.drop(store)
+        boxstore.swept_overlapping(store, duck)
+        boxstore.destroy_targets(store, duck)
+    return (time.perf_counter() - start) / ticks * 1000
+
+
+def time_entities(quantity, passes=20):
+    """
+    Compares boxes kept as dictionaries with boxes kept as `entities.Box`
+    objects. Returns the average time in milliseconds of one pass of overlap
+    tests over all boxes and the memory taken by the boxes in bytes, first
+    for the dictionaries and then for the objects.
+
+    :Parameters:
+        `quantity` : int
+            The number of boxes.
+        `passes` : int
+            The number of passes to time.
+    """
+    def dict_pass(boxes):
+        return sum(1 for box in boxes
+                   if box["x"] < 1000 < box["x"] + box["w"] and box["y"] < 200 < box["y"] + box["h"])
+
+    def object_pass(boxes):
+        return sum(1 for box in boxes
+                   if box.x < 1000 < box.x + box.w and box.y < 200 < box.y + box.h)
+
+    def create_dicts(data):
+        return [{
+            "type": box["type"],
+            "x": float(box["x"]),
+            "y": float(box["y"]),
+            "w": float(box["w"]),
+            "h": float(box["h"]),
+            "vy": float(box["vy"]),
+            "settled": False,
+            "index": index
+        } for index, box in enumerate(data)]
+
+    results = []
+    for create, overlaps in ((create_dicts, dict_pass), (entities.load_boxes, object_pass)):
+        data = physics.create_boxes(quantity, random.Random(quantity))
+        tracemalloc.start()
+        boxes = create(data)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        start = time.perf_counter()
+        for _ in range(passes):
+            overlaps(boxes)
+        results.append(((time.perf_counter() - start) / passes * 1000, size))
+    (dict_ms, dict_size), (object_ms, object_size) = results
+    return dict_ms, object_ms, dict_size, object_size
+
+
+def time_level_loading(quantity, repeat=5):
+    """
+    Saves a random level with the given number of boxes as a JSON and as a
+    binary level file and returns the file sizes in bytes and the best times
+    in milliseconds of loading the level from each: with levelfile.load from
+    JSON, with levelfile.load from binary and, if NumPy is installed, with
+    boxstore.map_level (otherwise `None`).
+
+    :Parameters:
+        `quantity` : int
+            The number of boxes in the level.
+        `repeat` : int
+            How many times each file is loaded.
+    """
+    level = {
+        "boxes": physics.create_boxes(quantity, random.Random(quantity)),
+        "ducks": physics.MAX_DUCKS,
+        "next_level": "win"
+    }
+    loaders = [levelfile.load, levelfile.load]
+    if boxstore:
+        loaders.append(boxstore.map_level)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [os.path.join(directory, "level.json"), os.path.join(directory, "level.lvl")]
+        for path in paths:
+            levelfile.save(path, level)
+        sizes = [os.path.getsize(path) for path in paths]
+        times = []
+        for loader, path in zip(loaders, paths + paths[1:]):
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                loaded = loader(path)
+                elapsed = (time.perf_counter() - start) * 1000
+                del loaded
+                best = elapsed if best is None else min(best, elapsed)
+            times.append(best)
+    if not boxstore:
+        times.append(None)
+    return sizes + times
+
+
+def time_shot_cache(level="level1.json"):
+    """
+    Solves a level three times in one process: without a shot cache, with
+    an empty cache and again with the filled cache. Returns the three times
+    in seconds and the cache's hit rate.
+
+    :Parameters:
+        `level` : str
+            Path to a level file.
+    """
+    boxes = solver.level_boxes(level)
+    cache = shotcache.create_cache()
+    times = []
+    for used_cache in (None, cache, cache):
+        start = time.perf_counter()
+        solver.solve(boxes, processes=1, cache=used_cache)
+        times.append(time.perf_counter() - start)
+    return times + [shotcache.stats(cache)["hit_rate"]]
+
+
+def create_bench_world(boxes, ducks):
+    """
+    Creates a world with the given number of boxes in stacks (see
+    `create_stacks`) and used ducks resting on top of the stacks. The world
+    is stepped until everything has come to rest; the ducks on top of a
+    target destroy it.
+
+    :Parameters:
+        `boxes` : int
+            The number of boxes.
+        `ducks` : int
+            The number of used ducks.
+    """
+    world = physics.create_world(create_stacks(boxes))
+    stacks = max((boxes + 4) // 5, 1)
+    for i in range(ducks):
+        physics.add_used_duck(world, entities.Duck(400 + (i % stacks) * 80,
+                                                   physics.GROUND_LEVEL + min(boxes, 5) * 40))
+    for _ in range(10):
+        physics.step(world)
+    return world
+
+
+def put_duck(world, x, y, x_velocity, y_velocity):
+    """Puts the duck into the given position and gives it a velocity."""
+    duck = world["duck"]
+    duck.x = x
+    duck.y = y
+    duck.x_velocity = x_velocity
+    duck.y_velocity = y_velocity
+
+
+def measure(setup, run, number, repeat):
+    """
+    Returns the median time in milliseconds that one call of run takes.
+    The states for the calls are created with setup before the timer is
+    started, so setting up doesn't count. Garbage collection is turned off
+    while timing, same as in timeit, so that collecting the states doesn't
+    count either.
+
+    :Parameters:
+        `setup` : A function that returns a state for one call of run.
+        `run` : A function that takes the state.
+        `number` : int
+            The number of calls per repeat.
+        `repeat` : int
+            The number of repeats. The median of them is returned.
+    """
+    times = []
+    for _ in range(repeat):
+        states = [setup() for _ in range(number)]
+        gc.disable()
+        start = time.perf_counter()
+        for state in states:
+            run(state)
+        times.append((time.perf_counter() - start) / number * 1000)
+        gc.enable()
+        # Free the states here, not when the next repeat's first state is
+        # taken into use
+        del states, state
+    return statistics.median(times)
+
+
+def bench_update(world):
+    """Times one game tick with the duck flying into the stacks."""
+    def setup():
+        game = physics.copy_world(world)
+        game.update({"level": "level1", "next_level": "level2", "seed": 0, "ticks": 0})
+        put_duck(game, 300, 400, 15, -5)
+        game["flight"] = True
+        game["ducks"] = 1
+        return game
+    return setup, levels.advance
+
+
+def bench_drop_boxes_falling(world):
+    """Times dropping the boxes when all of them have just been woken."""
+    def setup():
+        copy = physics.copy_world(world)
+        for box in copy["boxes"]:
+            physics.wake_box(copy, box)
+        return copy
+    return setup, physics.drop_boxes
+
+
+def bench_drop_boxes_settled(world):
+    """Times dropping the boxes when all of them have settled."""
+    return (lambda: world), physics.drop_boxes
+
+
+def bench_drop_ducks(world):
+    """Times dropping the used ducks resting on the stacks."""
+    return (lambda: world), physics.drop_ducks
+
+
+def bench_drop_ducks_awake(world):
+    """Times dropping the used ducks when all of them have just been woken."""
+    def setup():
+        copy = physics.copy_world(world)
+        physics.wake_ducks(copy, 0, physics.WIN_WIDTH * 100, 0, physics.WIN_HEIGHT)
+        return copy
+    return setup, physics.drop_ducks
+
+
+def bench_move_duck(world):
+    """Times moving the duck into the top of the first stack."""
+    def run(world):
+        put_duck(world, 420, 300, 20, -20)
+        physics.move_duck(world)
+    return (lambda: world), run
+
+
+def bench_check_overlaps(world):
+    """Times pushing the duck out of the bottom box of the first stack."""
+    def run(world):
+        put_duck(world, 410, 90, 0, 0)
+        physics.check_overlaps(world)
+    return (lambda: world), run
+
+
+def bench_destroy_targets(world):
+    """Times destroying the target the duck overlaps."""
+    def setup():
+        copy = physics.copy_world(world)
+        put_duck(copy, 400, 130, 0, 0)
+        return copy
+    return setup, lambda world: physics.destroy_targets(world, world["duck"])
+
+
+def bench_create_boxes(world):
+    """Times creating a random level with as many boxes as the world has."""
+    quantity = len(world["boxes"])
+    return (lambda: random.Random(quantity)), lambda rng: physics.create_boxes(quantity, rng)
+
+
+# Benchmark name: (function that returns setup and run, used duck counts)
+SUITE = {
+    "update": (bench_update, (0, 16)),
+    "drop_boxes_falling": (bench_drop_boxes_falling, (0,)),
+    "drop_boxes_settled": (bench_drop_boxes_settled, (0,)),
+    "drop_ducks": (bench_drop_ducks, (16, 256)),
+    "drop_ducks_awake": (bench_drop_ducks_awake, (16, 256)),
+    "move_duck": (bench_move_duck, (0,)),
+    "check_overlaps": (bench_check_overlaps, (0,)),
+    "destroy_targets": (bench_destroy_targets, (0,)),
+    "create_boxes": (bench_create_boxes, (0,))
+}
+
+BOX_COUNTS = (2, 10, 100, 1000, 10000)
+
+
+def run_suite(names=None, box_counts=BOX_COUNTS, repeat=5):
+    """
+    Runs the benchmarks of the suite and returns a list of result
+    dictionaries with name, boxes, ducks and ms keys, ms being the median
+    time of one call in milliseconds.
+
+    :Parameters:
+        `names` : A `list` of benchmark names. Defaults to all of them.
+        `box_counts` : A sequence of box counts to run each benchmark with.
+        `repeat` : int
+            The number of repeats per benchmark.
+    """
+    results = []
+    for name in names or SUITE:
+        bench, duck_counts = SUITE[name]
+        for boxes in box_counts:
+            for ducks in duck_counts:
+                world = create_bench_world(boxes, ducks)
+                setup, run = bench(world)
+                number = max(3, min(200, 20000 // boxes))
+                results.append({
+                    "name": name,
+                    "boxes": boxes,
+                    "ducks": ducks,
+                    "ms": measure(setup, run, number, repeat)
+                })
+    return results
+
+
+def compare(results, baseline):
+    """
+    Compares results with a baseline and returns a list of (result, baseline
+    time, ratio) tuples for the benchmarks found in both. Benchmarks are
+    matched by name, box count and used duck count.
+
+    :Parameters:
+        `results` : A `list` of results from `run_suite`.
+        `baseline` : A `list` of results from an earlier run.
+    """
+    old = {(entry["name"], entry["boxes"], entry["ducks"]): entry["ms"] for entry in baseline}
+    compared = []
+    for result in results:
+        key = (result["name"], result["boxes"], result["ducks"])
+        if key in old:
+            compared.append((result, old[key], result["ms"] / old[key]))
+    return compared
+
+
+def print_scaling_tables():
+    """
+    Prints the scaling tables of the collision queries and box drops, the
+    comparison of box dictionaries and box objects, the level loading times
+    and the effect of the shot cache.
+    """
+    print("Collision queries per tick")
+    print("{:>8} {:>10}".format("boxes", "ms/tick"))
+    for count in (2, 10, 100, 1000, 2000, 5000):
+        print("{:>8} {:>10.4f}".format(count, time_collision_queries(count)))
+
+    print()
+    print("drop_boxes per tick in random levels")
+    print("{:>8} {:>12} {:>12}".format("boxes", "falling ms", "settled ms"))
+    for count in (2, 100, 400, 1000, 2000):
+        print("{:>8} {:>12.4f} {:>12.4f}".format(count, *time_drop_boxes(count)))
+
+    print()
+    print("Boxes as dictionaries and as entities.Box objects")
+    print("{:>8} {:>10} {:>10} {:>12} {:>12}".format(
+        "boxes", "dict ms", "Box ms", "dict bytes", "Box bytes"))
+    for count in (100, 1000, 10000):
+        print("{:>8} {:>10.4f} {:>10.4f} {:>12} {:>12}".format(count, *time_entities(count)))
+
+    print()
+    print("Loading a level from a file")
+    print("{:>8} {:>12} {:>12} {:>10} {:>10} {:>10}".format(
+        "boxes", "JSON bytes", "lvl bytes", "JSON ms", "lvl ms", "mmap ms"))
+    for count in (1000, 10000, 100000):
+        json_size, lvl_size, json_ms, lvl_ms, mmap_ms = time_level_loading(count)
+        mmap_text = "-" if mmap_ms is None else "{:.3f}".format(mmap_ms)
+        print("{:>8} {:>12} {:>12} {:>10.3f} {:>10.3f} {:>10}".format(
+            count, json_size, lvl_size, json_ms, lvl_ms, mmap_text))
+
+    print()
+    print("Solving level1.json with a shot cache")
+    print("{:>12} {:>12} {:>12} {:>10}".format("uncached s", "first s", "repeat s", "hit rate"))
+    print("{:>12.3f} {:>12.3f} {:>12.4f} {:>10.2f}".format(*time_shot_cache()))
+
+    print()
+    if boxstore:
+        print("NumPy box store per tick")
+        print("{:>8} {:>10}".format("boxes", "ms/tick"))
+        for count in (100, 1000, 10000):
+            print("{:>8} {:>10.4f}".format(count, time_box_store(count)))
+    else:
+        print("NumPy is not installed, skipping the box store benchmark")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the simulation core.")
+    parser.add_argument("--json", help="save the results into this file")
+    parser.add_argument("--compare", help="compare the results with this saved file")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="slowdown that counts as a regression, e.g. 0.15 for 15 %%")
+    parser.add_argument("--only", nargs="+", choices=sorted(SUITE), help="benchmarks to run")
+    parser.add_argument("--boxes", nargs="+", type=int, default=BOX_COUNTS, help="box counts")
+    parser.add_argument("--repeat", type=int, default=5, help="repeats per benchmark")
+    parser.add_argument("--scaling", action="store_true", help="print the scaling tables")
+    args = parser.parse_args()
+
+    if args.scaling:
+        print_scaling_tables()
+        sys.exit()
+
+    suite_results = run_suite(args.only, args.boxes, args.repeat)
+    print("{:<20} {:>8} {:>6} {:>12}".format("benchmark", "boxes", "ducks", "ms/call"))
+    for entry in suite_results:
+        print("{name:<20} {boxes:>8} {ducks:>6} {ms:>12.4f}".format(**entry))
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "repeat": args.repeat,
+                "results": suite_results
+            }, file, indent=4)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline_results = json.load(file)["results"]
+        regressions = 0
+        print()
+        print("{:<20} {:>8} {:>6} {:>12} {:>12} {:>8}".format(
+            "benchmark", "boxes", "ducks", "baseline ms", "ms/call", "ratio"))
+        for entry, old_ms, ratio in compare(suite_results, baseline_results):
+            regression = ratio > 1 + args.threshold
+            regressions += regression
+            print("{:<20} {:>8} {:>6} {:>12.4f} {:>12.4f} {:>8.2f}{}".format(
+                entry["name"], entry["boxes"], entry["ducks"], old_ms, entry["ms"], ratio,
+                "  REGRESSION" if regression else ""))
+        print("{} regressions".format(regressions))
+        sys.exit(1 if regressions else 0)
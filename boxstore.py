@@ -0,0 +1,400 @@
+"""
+Box storage as one NumPy array per value, so overlap tests and gravity can be
+computed for thousands of boxes at once. Requires NumPy.
+"""
+import mmap
+import numpy
+import levelfile
+from levelfile import TYPE_NAMES, TYPE_CODES
+from physics import GROUND_LEVEL, GRAVITATIONAL_ACCEL
+
+FLOAT_FIELDS = ("x", "y", "w", "h", "vy")
+
+# The box records of a binary level file, see levelfile
+RECORD_DTYPE = numpy.dtype({
+    "names": FLOAT_FIELDS + ("type",),
+    "formats": ["<f8"] * len(FLOAT_FIELDS) + ["i1"],
+    "offsets": [0, 8, 16, 24, 32, 40],
+    "itemsize": levelfile.RECORD.size
+})
+
+
+def create_store(capacity=64):
+    """
+    Creates an empty box store: a dictionary of arrays for x, y, w, h, vy,
+    the type code, the settled flag and an alive mask, and the number of
+    slots in use.
+
+    :Parameters:
+        `capacity` : int
+            The number of boxes the store has room for before it has to grow.
+    """
+    store = {"count": 0}
+    for field in FLOAT_FIELDS:
+        store[field] = numpy.zeros(capacity)
+    store["type"] = numpy.zeros(capacity, dtype=numpy.int8)
+    store["alive"] = numpy.zeros(capacity, dtype=bool)
+    store["settled"] = numpy.zeros(capacity, dtype=bool)
+    return store
+
+
+def grow(store, capacity):
+    """
+    Makes room for at least `capacity` boxes in the store.
+
+    :Parameters:
+        `store` : A `dict` created with `create_store`.
+        `capacity` : int
+            The required capacity.
+    """
+    old = len(store["alive"])
+    if capacity <= old:
+        return
+    capacity = max(capacity, old * 2)
+    for field in FLOAT_FIELDS + ("type", "alive", "settled"):
+        array = numpy.zeros(capacity, dtype=store[field].dtype)
+        array[:old] = store[field]
+        store[field] = array
+
+
+def add_box(store, box):
+    """
+    Adds a box to the store and returns its index. The box is given as a
+    dictionary with type, x, y, w, h and vy keys, same as in the level files.
+    New boxes start out falling.
+
+    :Parameters:
+        `store` : A `dict` created with `create_store`.
+        `box` : A `dict` describing a box.
+    """
+    free = numpy.flatnonzero(~store["alive"][:store["count"]])
+    if len(free):
+        index = free[0]
+    else:
+        index = store["count"]
+        grow(store, index + 1)
+        store["count"] += 1
+    for field in FLOAT_FIELDS:
+        store[field][index] = box.get(field, 0)
+    store["type"][index] = TYPE_CODES[box["type"]]
+    store["alive"][index] = True
+    store["settled"][index] = False
+    return index
+
+
+def from_boxes(boxes):
+    """
+    Creates a box store from a list of box dictionaries, e.g. the "boxes"
+    list of a level file.
+
+    :Parameters:
+        `boxes` : A `list` of `dict`s that describe boxes.
+                  The dictionaries must have type, x, y, w and h keys.
+    """
+    count = len(boxes)
+    store = create_store(max(count, 1))
+    store["count"] = count
+    for field in FLOAT_FIELDS:
+        store[field][:count] = [box.get(field, 0) for box in boxes]
+    store["type"][:count] = [TYPE_CODES[box["type"]] for box in boxes]
+    store["alive"][:count] = True
+    return store
+
+
+def map_level(path):
+    """
+    Memory-maps a binary level file (see levelfile) and returns a tuple of a
+    box store that uses the file's box records as its arrays, the number of
+    ducks and the next level. Nothing is parsed or copied when loading; the
+    records are read from the file when they are first used. The mapping is
+    copy-on-write, so changing the store never changes the file.
+
+    :Parameters:
+        `path` : str
+            Path to a ".lvl" file.
+    """
+    with open(path, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+    ducks, next_level, count, offset = levelfile.read_header(buffer)
+    records = numpy.frombuffer(buffer, dtype=RECORD_DTYPE, count=count, offset=offset)
+    store = {"count": count}
+    for field in FLOAT_FIELDS + ("type",):
+        store[field] = records[field]
+    store["alive"] = numpy.ones(count, dtype=bool)
+    store["settled"] = numpy.zeros(count, dtype=bool)
+    return store, ducks, next_level
+
+
+def to_boxes(store):
+    """
+    Returns the alive boxes as a list of dictionaries with type, x, y, w, h
+    and vy keys. The list can be saved into a level file or drawn like the
+    boxes of the physics module.
+
+    :Parameters:
+        `store` : A `dict` created with `create_store`.
+    """
+    indices = alive_indices(store)
+    columns = [store[field][indices].tolist() for field in FLOAT_FIELDS]
+    types = store["type"][indices].tolist()
+    return [{
+        "type": TYPE_NAMES[code],
+        "x": x,
+        "y": y,
+        "w": w,
+        "h": h,
+        "vy": vy
+    } for code, x, y, w, h, vy in zip(types, *columns)]
+
+
+def alive_indices(store):
+    """Returns an array of the indices of the boxes that haven't been destroyed."""
+    return numpy.flatnonzero(store["alive"][:store["count"]])
+
+
+def count_type(store, box_type):
+    """
+    Returns the number of alive boxes of the given type.
+
+    :Parameters:
+        `store` : A `dict` created with `create_store`.
+        `box_type` : str
+            Either "target" or "obstacle".
+    """
+    count = store["count"]
+    return int(numpy.count_nonzero(store["alive"][:count] &
+                                   (store["type"][:count] == TYPE_CODES[box_type])))
+
+
+def overlapping(store, min_x, max_x, min_y, max_y):
+    """
+    Returns an array of the indices of the alive boxes that are inside the
+    area defined by the minimum and maximum x and y values. Touching the
+    area's edge counts, same as in physics.is_inside_area.
+
+    :Parameters:
+        `store` : A `dict` created with `create_store`.
+        `min_x` : float
+            Minimum x value of the area.
+        `max_x` : float
+            Maximum x value of the area.
+        `min_y` : float
+            Minimum y value of the area.
+        `max_y` : float
+            Maximum y value of the area.
+    """
+    count = store["count"]
+    x = store["x"][:count]
+    y = store["y"][:count]
+    mask = store["alive"][:count].copy()
+    mask &= y <= max_y
+    mask &= y + store["h"][:count] >= min_y
+    mask &= x <= max_x
+    mask &= x + store["w"][:count] >= min_x
+    return numpy.flatnonzero(mask)
+
+
+def swept_overlapping(store, duck):
+    """
+    Returns an array of the indices of the alive boxes inside the area that
+    the duck sweeps through during the next time unit, same area as in
+    physics.move_duck.
+
+    :Parameters:
+        `store` : A `dict` created with `create_store`.
+        `duck` : An `entities.Duck`.
+    """
+    return overlapping(store,
+                       duck.x + min(duck.x_velocity, 0),
+                       duck.x + duck.w + max(duck.x_velocity, 0),
+                       duck.y + min(duck.y_velocity, 0),
+                       duck.y + duck.h + max(duck.y_velocity, 0))
+
+
+def wake_boxes_above(store, indices):
+    """
+    Marks the settled boxes resting on the given boxes as falling, and the
+    boxes resting on those, and so on.
+
+    :Parameters:
+        `store` : A `dict` created with `create_store`.
+        `indices` : An array of box indices.
+    """
+    count = store["count"]
+    x = store["x"][:count]
+    y = store["y"][:count]
+    w = store["w"][:count]
+    while len(indices):
+        tops = y[indices] + store["h"][indices]
+        resting = (store["alive"][:count] & store["settled"][:count] &
+                   (y[:, None] == tops) &
+                   (x[:, None] < x[indices] + w[indices]) &
+                   (x[:, None] + w[:, None] > x[indices])).any(axis=1)
+        indices = numpy.flatnonzero(resting)
+        store["settled"][indices] = False
+
+
+def remove_boxes(store, indices):
+    """
+    Destroys the given boxes and wakes the boxes that were resting on them.
+    The boxes are only marked as not alive; `add_box` reuses their slots.
+
+    :Parameters:
+        `store` : A `dict` created with `create_store`.
+        `indices` : An array of box indices.
+    """
+    store["alive"][indices] = False
+    wake_boxes_above(store, indices)
+
+
+def destroy_targets(store, duck):
+    """
+    Destroys the targets that are overlapping the duck and returns their
+    indices.
+
+    :Parameters:
+        `store` : A `dict` created with `create_store`.
+        `duck` : An `entities.Duck`.
+    """
+    hits = overlapping(store,
+                       duck.x,
+                       duck.x + duck.w,
+                       duck.y,
+                       duck.y + duck.h)
+    targets = hits[store["type"][hits] == TYPE_CODES["target"]]
+    if len(targets):
+        remove_boxes(store, targets)
+    return targets
+
+
+def stack_falling(store, falling, old_y, chunk=1024):
+    """
+    Puts the boxes that were falling during this time unit on top of each
+    other where they ended up overlapping. Because all boxes are moved at
+    once, a box can end up inside a box that was below it at the start of
+    the time unit, e.g. when the lower box has just landed. Such a box is
+    moved on top of the lower box, and it lands too if the lower box landed,
+    otherwise it falls together with it. Repeated until nothing moves, so a
+    whole stack is sorted out in the same time unit.
+
+    The boxes are compared in chunks sorted by x, and each chunk only against
+    the boxes that are horizontally within reach of it.
+
+    :Parameters:
+        `store` : A `dict` created with `create_store`.
+        `falling` : An array of the indices of the boxes that were falling.
+        `old_y` : An array of their y coordinates before they were moved.
+        `chunk` : int
+            How many boxes are compared against the others in one go.
+    """
+    if len(falling) < 2:
+        return
+    x = store["x"]
+    y = store["y"]
+    w = store["w"]
+    h = store["h"]
+    vy = store["vy"]
+    settled = store["settled"]
+
+    by_x = numpy.argsort(x[falling], kind="stable")
+    falling = falling[by_x]
+    old_y = old_y[by_x]
+    order = by_x
+    left = x[falling]
+    reach = w[falling].max()
+    for _ in range(len(falling)):
+        moved = False
+        moving = numpy.flatnonzero(~settled[falling])
+        for start in range(0, len(moving), chunk):
+            part = moving[start:start + chunk]
+            first = numpy.searchsorted(left, left[part[0]] - reach, side="left")
+            last = numpy.searchsorted(left, left[part[-1]] + reach, side="right")
+            others = falling[first:last]
+            box = falling[part, None]
+            lower = ((old_y[first:last] < old_y[part, None]) |
+                     (old_y[first:last] == old_y[part, None]) &
+                     (order[first:last] < order[part, None]))
+            mask = (lower &
+                    (x[others] < x[box] + w[box]) &
+                    (x[others] + w[others] > x[box]) &
+                    (y[others] < y[box] + h[box]) &
+                    (y[others] + h[others] > y[box]))
+            inside = mask.any(axis=1)
+            if not inside.any():
+                continue
+            moved = True
+            tops = numpy.where(mask, y[others] + h[others], -numpy.inf)
+            below = others[numpy.argmax(tops, axis=1)[inside]]
+            stacked = falling[part[inside]]
+            y[stacked] = y[below] + h[below]
+            vy[stacked] = vy[below]
+            settled[stacked] = settled[below]
+        if not moved:
+            return
+
+
+def drop(store, chunk=1024):
+    """
+    Drops the falling boxes for one time unit, all at once. Gravity is
+    applied to every box that isn't settled, and each of them is checked
+    against the settled boxes below it. A box that would pass the top of a
+    settled box or the ground lands on it and becomes settled. Falling boxes
+    that end up inside each other are then stacked with `stack_falling`.
+
+    Settled boxes cost nothing, so a level where everything rests takes one
+    mask check per tick.
+
+    :Parameters:
+        `store` : A `dict` created with `create_store`.
+        `chunk` : int
+            How many falling boxes are compared against the settled boxes in
+            one go. Limits the size of the temporary arrays.
+    """
+    count = store["count"]
+    alive = store["alive"][:count]
+    settled = store["settled"][:count]
+    falling = numpy.flatnonzero(alive & ~settled)
+    if not len(falling):
+        return
+
+    x = store["x"]
+    y = store["y"]
+    w = store["w"]
+    h = store["h"]
+    vy = store["vy"]
+
+    old_y = y[falling]
+    velocity = vy[falling] + GRAVITATIONAL_ACCEL
+    new_y = old_y - velocity
+    support = numpy.full(len(falling), -numpy.inf)
+
+    resting = numpy.flatnonzero(alive & settled)
+    if len(resting):
+        rest_x = x[resting]
+        rest_right = rest_x + w[resting]
+        rest_y = y[resting]
+        rest_top = rest_y + h[resting]
+        for start in range(0, len(falling), chunk):
+            part = falling[start:start + chunk]
+            part_new_y = new_y[start:start + chunk, None]
+            mask = ((rest_x < x[part, None] + w[part, None]) &
+                    (rest_right > x[part, None]) &
+                    (rest_y <= y[part, None]) &
+                    (rest_top >= part_new_y))
+            tops = numpy.where(mask, rest_top, -numpy.inf)
+            support[start:start + chunk] = tops.max(axis=1)
+
+    support = numpy.where((support == -numpy.inf) & (new_y <= GROUND_LEVEL),
+                          GROUND_LEVEL,
+                          support)
+    lands = support > -numpy.inf
+    landing = falling[lands]
+    y[landing] = support[lands]
+    vy[landing] = 0
+    store["settled"][landing] = True
+
+    moving = falling[~lands]
+    vy[moving] = velocity[~lands]
+    y[moving] = new_y[~lands]
+
+    stack_falling(store, falling, old_y, chunk)
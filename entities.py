@@ -0,0 +1,126 @@
+"""
+The bodies of the simulation: boxes and ducks.
+
+Levels can have thousands of boxes, and the simulation reads their
+coordinates in every collision check, so the bodies are small classes with
+`__slots__` instead of dictionaries. An instance takes about a third of the
+memory of the same values in a dictionary, and reading an attribute is
+faster than looking up a key.
+
+The level files describe boxes as dictionaries with type, x, y, w, h and vy
+keys. `box_from_dict` and `box_to_dict` convert between the two, and
+`load_boxes` and `dump_boxes` do the same for whole lists.
+"""
+
+
+class Box:
+    """
+    A box in the world. The type is either "target" or "obstacle", x and y
+    are the coordinates of the bottom left corner, w and h the size, and vy
+    the falling velocity (positive downwards). A settled box is resting on
+    something and isn't moved until it is woken. The index is the box's
+    position in the level's list of boxes, or -1 if it isn't known.
+    """
+    __slots__ = ("type", "x", "y", "w", "h", "vy", "settled", "index")
+
+    def __init__(self, box_type, x, y, w=40.0, h=40.0, vy=0.0, index=-1):
+        self.type = box_type
+        self.x = float(x)
+        self.y = float(y)
+        self.w = float(w)
+        self.h = float(h)
+        self.vy = float(vy)
+        self.settled = False
+        self.index = index
+
+    def copy(self):
+        """Returns a copy of the box."""
+        box = Box(self.type, self.x, self.y, self.w, self.h, self.vy, self.index)
+        box.settled = self.settled
+        return box
+
+    def __repr__(self):
+        return "Box({!r}, {}, {}, {}, {}, vy={})".format(
+            self.type, self.x, self.y, self.w, self.h, self.vy)
+
+
+class Duck:
+    """
+    A duck, either the one being launched or a used one lying in the world.
+    x and y are the coordinates of the bottom left corner, w and h the size,
+    and the velocities are positive to the right and upwards. A settled used
+    duck is resting on something and isn't moved until it is woken.
+    """
+    __slots__ = ("x", "y", "w", "h", "x_velocity", "y_velocity", "settled")
+
+    def __init__(self, x, y, w=40.0, h=40.0, x_velocity=0.0, y_velocity=0.0):
+        self.x = float(x)
+        self.y = float(y)
+        self.w = float(w)
+        self.h = float(h)
+        self.x_velocity = float(x_velocity)
+        self.y_velocity = float(y_velocity)
+        self.settled = False
+
+    def copy(self):
+        """Returns a copy of the duck."""
+        duck = Duck(self.x, self.y, self.w, self.h, self.x_velocity, self.y_velocity)
+        duck.settled = self.settled
+        return duck
+
+    def __repr__(self):
+        return "Duck({}, {}, {}, {}, x_velocity={}, y_velocity={})".format(
+            self.x, self.y, self.w, self.h, self.x_velocity, self.y_velocity)
+
+
+def box_from_dict(data, index=-1):
+    """
+    Creates a box from a dictionary in the level file format. The vy key
+    is optional.
+
+    :Parameters:
+        `data` : A `dict` with type, x, y, w and h keys.
+        `index` : int
+            The box's position in the level's list of boxes.
+    """
+    return Box(data["type"], data["x"], data["y"], data["w"], data["h"], data.get("vy", 0), index)
+
+
+def box_to_dict(box):
+    """
+    Returns a dictionary in the level file format that describes the box.
+
+    :Parameters:
+        `box` : A `Box`.
+    """
+    return {
+        "type": box.type,
+        "x": box.x,
+        "y": box.y,
+        "w": box.w,
+        "h": box.h,
+        "vy": box.vy
+    }
+
+
+def load_boxes(boxes):
+    """
+    Creates boxes from a list of dictionaries in the level file format, e.g.
+    the "boxes" list of a level file. Each box gets its position in the list
+    as its index.
+
+    :Parameters:
+        `boxes` : A `list` of `dict`s that describe boxes.
+    """
+    return [box_from_dict(data, index) for index, data in enumerate(boxes)]
+
+
+def dump_boxes(boxes):
+    """
+    Returns a list of dictionaries in the level file format that describe
+    the boxes, e.g. for saving them into a level file.
+
+    :Parameters:
+        `boxes` : A `list` of `Box`es.
+    """
+    return [box_to_dict(box) for box in boxes]
@@ -0,0 +1,169 @@
+"""
+Reading and writing level files, either in the JSON format of level1.json and
+level2.json or in a compact binary format for huge generated levels. The
+format is picked by the file's extension: ".json" or ".lvl". Convert a level
+from one format to the other from the command line:
+
+    python levelfile.py level1.json level1.lvl
+
+A level is a dictionary with the same keys in both formats: "boxes", a list
+of box dictionaries with type, x, y, w, h and vy keys, "ducks" and
+"next_level".
+
+The binary format starts with a header:
+
+    magic        4 bytes   b"MDLV"
+    version      uint16
+    ducks        uint16
+    box count    uint32
+    name length  uint16    length of next_level in UTF-8
+    padding      2 bytes
+    next_level   UTF-8, padded with zeros to a multiple of 8 bytes
+
+followed by one fixed-size record per box: x, y, w, h and vy as float64 and
+the type code (0 for a target, 1 for an obstacle) as int8, padded to 48
+bytes. All values are little-endian. Because the records are fixed-size and
+aligned, the file can be memory-mapped and used as arrays without parsing,
+see boxstore.map_level.
+"""
+import argparse
+import json
+import struct
+
+MAGIC = b"MDLV"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHHIH2x")
+RECORD = struct.Struct("<5db7x")
+
+TYPE_NAMES = ("target", "obstacle")
+TYPE_CODES = {"target": 0, "obstacle": 1}
+
+EXTENSIONS = (".json", ".lvl")
+
+
+def is_level_file(path):
+    """Returns True if the path has the extension of a level file."""
+    return path.endswith(EXTENSIONS)
+
+
+def read_header(buffer):
+    """
+    Reads the header of a binary level and returns a tuple of the number of
+    ducks, the next level, the number of boxes and the offset of the first
+    box record.
+
+    :Parameters:
+        `buffer` : The contents of a binary level file, e.g. `bytes` or an
+                   `mmap`.
+    """
+    magic, version, ducks, count, name_length = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ValueError("Not a binary level file")
+    if version != VERSION:
+        raise ValueError("Unsupported level file version: {}".format(version))
+    start = HEADER.size
+    next_level = bytes(buffer[start:start + name_length]).decode("utf-8")
+    offset = start + (name_length + 7) // 8 * 8
+    if len(buffer) < offset + count * RECORD.size:
+        raise ValueError("The level file is truncated")
+    return ducks, next_level, count, offset
+
+
+def decode(buffer):
+    """
+    Returns the level stored in the contents of a binary level file.
+
+    :Parameters:
+        `buffer` : The contents of a binary level file.
+    """
+    ducks, next_level, count, offset = read_header(buffer)
+    records = memoryview(buffer)[offset:offset + count * RECORD.size]
+    return {
+        "boxes": [{
+            "type": TYPE_NAMES[code],
+            "x": x,
+            "y": y,
+            "w": w,
+            "h": h,
+            "vy": vy
+        } for x, y, w, h, vy, code in RECORD.iter_unpack(records)],
+        "ducks": ducks,
+        "next_level": next_level
+    }
+
+
+def encode(level):
+    """
+    Returns the contents of a binary level file that stores the level.
+
+    :Parameters:
+        `level` : A level `dict` with boxes, ducks and next_level keys.
+    """
+    name = level["next_level"].encode("utf-8")
+    boxes = level["boxes"]
+    parts = [HEADER.pack(MAGIC, VERSION, level["ducks"], len(boxes), len(name)),
+             name.ljust((len(name) + 7) // 8 * 8, b"\0")]
+    parts.extend(RECORD.pack(box["x"],
+                             box["y"],
+                             box["w"],
+                             box["h"],
+                             box.get("vy", 0),
+                             TYPE_CODES[box["type"]])
+                 for box in boxes)
+    return b"".join(parts)
+
+
+def load(path):
+    """
+    Loads a level from a JSON or binary level file.
+
+    :Parameters:
+        `path` : str
+            Path to the file.
+    """
+    if path.endswith(".lvl"):
+        with open(path, "rb") as file:
+            return decode(file.read())
+    with open(path) as file:
+        return json.load(file)
+
+
+def save(path, level):
+    """
+    Saves a level into a JSON or binary level file. Only the boxes, ducks
+    and next_level keys are saved into a binary file.
+
+    :Parameters:
+        `path` : str
+            Path to the file.
+        `level` : A level `dict` with boxes, ducks and next_level keys.
+    """
+    if path.endswith(".lvl"):
+        with open(path, "wb") as file:
+            file.write(encode(level))
+    else:
+        with open(path, "w") as file:
+            json.dump(level, file, indent=4)
+
+
+def convert(source, destination):
+    """
+    Converts a level file into the format of the destination's extension.
+
+    :Parameters:
+        `source` : str
+            Path to the level file to read.
+        `destination` : str
+            Path to the level file to write.
+    """
+    save(destination, load(source))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converts level files between JSON and binary.")
+    parser.add_argument("source", help="a level file, e.g. level1.json")
+    parser.add_argument("destination", help="the converted file, e.g. level1.lvl")
+    args = parser.parse_args()
+
+    convert(args.source, args.destination)
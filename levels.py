@@ -0,0 +1,335 @@
+"""
+Level loading and progression, without pyglet, so that the game can be played
+through headlessly, e.g. when a replay is played back.
+
+The game state is a world dictionary (see physics.create_world) with a few
+extra keys created by `create_game`: the current level, the next level, the
+number of random levels passed, the run's seed and the number of ticks
+stepped so far.
+
+Random levels are created from the run's seed: each level gets its own random
+generator seeded with the run's seed and the level's number, so the same seed
+always produces the same levels.
+
+Read and created levels are kept in a small cache. When a level is loaded,
+the level after it is read or created and its boxes are loaded in a
+background thread while the player plays, and so are the boxes of the level
+itself if it can be restarted, so moving on or restarting doesn't stall the
+game.
+Because a level's contents only depend on the file or on the seed, the cache
+never changes what is loaded, and replays play back the same with or without
+it.
+"""
+import collections
+import os
+import random
+import threading
+import levelfile
+import physics
+
+# How many read or created levels are kept in the cache
+CACHE_SIZE = 8
+
+
+def create_game(seed):
+    """
+    Creates a new game state, starting from the menu.
+
+    :Parameters:
+        `seed` : int
+            The seed used for creating the run's random levels.
+    """
+    game = physics.create_world()
+    game.update({
+        "level": "menu",
+        "next_level": None,
+        "random_levels_passed": 0,
+        "seed": seed,
+        "ticks": 0
+    })
+    return game
+
+
+def level_rng(seed, number):
+    """
+    Returns the random generator used for creating the boxes of the given
+    random level in a run with the given seed.
+
+    :Parameters:
+        `seed` : int
+            The seed of the run.
+        `number` : int
+            The level's number, starting from 1.
+    """
+    return random.Random("{}:{}".format(seed, number))
+
+
+def create_level(seed, number):
+    """
+    Creates the boxes of a random level: level number n has 2n boxes.
+
+    :Parameters:
+        `seed` : int
+            The seed of the run.
+        `number` : int
+            The level's number, starting from 1.
+    """
+    return physics.create_boxes(number * 2, level_rng(seed, number))
+
+
+def create_cache(size=CACHE_SIZE):
+    """
+    Creates an empty level cache. Each cached level has an entry with the
+    level as read from the file or created ("level", see `read_level`) and
+    a set of boxes loaded from it with physics.build_boxes ("prepared"),
+    ready to be played once, or `None`.
+
+    :Parameters:
+        `size` : int
+            The most levels kept; the least recently used is dropped first.
+    """
+    return {
+        "size": size,
+        "levels": collections.OrderedDict(),
+        "pending": {},
+        "lock": threading.Lock()
+    }
+
+
+cache = create_cache()
+
+
+def cache_key(seed, level):
+    """
+    Returns the key of a level in the cache. Random levels are keyed by the
+    seed too, since the same name gives different levels in different runs.
+    """
+    if levelfile.is_level_file(level):
+        return level
+    return level, seed
+
+
+def level_number(level):
+    """Returns the number in a random level's name, e.g. 3 for "level3"."""
+    return int("".join(c for c in level if c.isdigit()))
+
+
+def can_restart(level):
+    """
+    Returns True if the level can be restarted: normal levels always can,
+    random levels only the first one.
+    """
+    return levelfile.is_level_file(level) or level_number(level) == 1
+
+
+def is_playing(level):
+    """
+    Returns True if the name is a level, either a level file or a random
+    level, and not the menu or an end screen.
+    """
+    return levelfile.is_level_file(level) or level.startswith("level")
+
+
+def is_loadable(level):
+    """
+    Returns True if the level is a random level or a level file that exists,
+    i.e. loading it could succeed.
+    """
+    if levelfile.is_level_file(level):
+        return os.path.isfile(level)
+    return level.startswith("level")
+
+
+def read_level(seed, level):
+    """
+    Reads a level file or creates a random level and returns it as a
+    dictionary with boxes, ducks and next_level keys, see levelfile.
+
+    :Parameters:
+        `seed` : int
+            The seed of the run, used for random levels.
+        `level` : str
+            "levelX.json" or "levelX.lvl" for a normal level or "levelX" for
+            a random level, see `load_level`.
+    """
+    if levelfile.is_level_file(level):
+        data = levelfile.load(level)
+        # A level file names the next one relative to its own directory
+        if levelfile.is_level_file(data["next_level"]):
+            data["next_level"] = os.path.join(os.path.dirname(level), data["next_level"])
+        return data
+    number = level_number(level)
+    boxes = create_level(seed, number)
+    return {
+        "boxes": boxes,
+        "ducks": min(len(boxes), physics.MAX_DUCKS),
+        "next_level": "level{}".format(number + 1)
+    }
+
+
+def cache_entry(level_cache, key):
+    """
+    Returns the cache entry of a level and marks it as the most recently
+    used, creating an empty entry if there isn't one. Drops the least
+    recently used entries that don't fit. Must be called with the lock held.
+    """
+    levels = level_cache["levels"]
+    entry = levels.get(key)
+    if entry is None:
+        entry = levels[key] = {"level": None, "prepared": None}
+    levels.move_to_end(key)
+    while len(levels) > level_cache["size"]:
+        levels.popitem(last=False)
+    return entry
+
+
+def take(level_cache, seed, level):
+    """
+    Returns a tuple of a level (see `read_level`) and its prepared boxes
+    from the cache. The level is read if it isn't cached, and the prepared
+    boxes are `None` if there aren't any. If the level is being preloaded,
+    waits for the preload to finish. Raises `IOError` or `ValueError` if the
+    level can't be read.
+
+    The prepared boxes are removed from the cache, since they can only be
+    played once. The level is shared with the cache and must not be
+    modified.
+
+    :Parameters:
+        `level_cache` : A `dict` created with `create_cache`.
+        `seed` : int
+            The seed of the run.
+        `level` : str
+            The level's name, see `load_level`.
+    """
+    key = cache_key(seed, level)
+    with level_cache["lock"]:
+        thread = level_cache["pending"].get(key)
+    if thread is not None:
+        thread.join()
+    with level_cache["lock"]:
+        entry = cache_entry(level_cache, key)
+        data, prepared = entry["level"], entry["prepared"]
+        entry["prepared"] = None
+    if data is None:
+        data = read_level(seed, level)
+        with level_cache["lock"]:
+            cache_entry(level_cache, key)["level"] = data
+    return data, prepared
+
+
+def preload(level_cache, seed, level):
+    """
+    Starts reading or creating a level into the cache and preparing its
+    boxes in a background thread, unless the level is prepared or being
+    preloaded already. A level that can't be read is left out of the cache,
+    so loading it reports the error.
+
+    :Parameters:
+        `level_cache` : A `dict` created with `create_cache`.
+        `seed` : int
+            The seed of the run.
+        `level` : str
+            The level's name, see `load_level`.
+    """
+    if level in (None, "win"):
+        return
+    key = cache_key(seed, level)
+
+    def work():
+        try:
+            with level_cache["lock"]:
+                entry = level_cache["levels"].get(key)
+                data = entry and entry["level"]
+            if data is None:
+                data = read_level(seed, level)
+            prepared = physics.build_boxes(data["boxes"])
+            with level_cache["lock"]:
+                entry = cache_entry(level_cache, key)
+                entry["level"] = data
+                entry["prepared"] = prepared
+        except (IOError, ValueError):
+            pass
+        finally:
+            with level_cache["lock"]:
+                del level_cache["pending"][key]
+
+    with level_cache["lock"]:
+        entry = level_cache["levels"].get(key)
+        if key in level_cache["pending"] or entry and entry["prepared"]:
+            return
+        thread = threading.Thread(target=work, daemon=True)
+        level_cache["pending"][key] = thread
+    thread.start()
+
+
+def load_level(game, level):
+    """
+    Loads a level.
+
+    :Parameters:
+        `game` : A `dict` created with `create_game`.
+        `level` : str
+            A String that tells the program which level to load.
+            Possible values:
+            "levelX.json" or "levelX.lvl", where X is a normal level's
+            number, see levelfile.
+            "levelX", where X is a random level's number.
+            "win", when the player passes all normal levels.
+
+    The level is taken from the cache if it's there. The next level and, if
+    the level can be restarted, a fresh copy of it are preloaded into the
+    cache.
+    """
+    physics.clear_used_ducks(game)
+    # If the player wins the game
+    if level == "win":
+        game["level"] = level
+        return
+    try:
+        data, prepared = take(cache, game["seed"], level)
+    except (IOError, ValueError):
+        print("Failed to load level.")
+        return
+    game["level"] = level
+    if prepared:
+        physics.use_boxes(game, *prepared)
+    else:
+        physics.set_boxes(game, data["boxes"])
+    game["ducks"] = data["ducks"]
+    game["next_level"] = data["next_level"]
+    # Random levels
+    if not levelfile.is_level_file(level):
+        game["random_levels_passed"] = level_number(level) - 1
+    # The next level, and this one again if it can be restarted
+    if is_loadable(game["next_level"]):
+        preload(cache, game["seed"], game["next_level"])
+    if can_restart(level):
+        preload(cache, game["seed"], level)
+
+
+def advance(game, dt=physics.TIME_STEP, lap=None):
+    """
+    Advances the game by one physics step and moves on to the next level when
+    the targets have been destroyed. A normal level is restarted and a random
+    level lost when the ducks run out.
+
+    :Parameters:
+        `game` : A `dict` created with `create_game`.
+        `dt` : float
+            The length of the time step in seconds.
+        `lap` : A function called after each phase, see physics.step.
+                Called with "levels" after the level has been checked.
+    """
+    physics.step(game, dt, lap)
+    game["ticks"] += 1
+    if not game["flight"]:
+        if not physics.targets_remaining(game):
+            load_level(game, game["next_level"])
+        elif game["ducks"] == 0:
+            if levelfile.is_level_file(game["level"]):
+                load_level(game, game["level"])
+            else:
+                game["level"] = "lose"
+    if lap:
+        lap("levels")
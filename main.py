@@ -29,6 +29,8 @@ Randomized levels:
 Controls:
     General:
         F: Toggle fullscreen on/off
+        F3: Toggle the profiling overlay
+        F4: Save the profiling records to profile.csv
         Q: Quit the game
         M: Menu
     In menu:
@@ -40,49 +42,70 @@ Controls:
         ↑/↓ or mouse drag: Set Force
         Space or mouse release: Launch
 """
-import json
+import argparse
 import math
+import os
 import random
+import aiming
+import audio
+import levels
+import physics
+import profiler
+import replay
 import sweeperlib
+from physics import WIN_WIDTH, WIN_HEIGHT, GROUND_LEVEL, LAUNCH_X, LAUNCH_Y
 
 
-WIN_WIDTH = 1920
-WIN_HEIGHT = 1080
-GROUND_LEVEL = 80
-LAUNCH_X = 100
-LAUNCH_Y = 100 + GROUND_LEVEL
 DRAG_RADIUS = 100
-GRAVITATIONAL_ACCEL = 1.5
-FORCE_FACTOR = 0.6
-ELASTICITY = 0.5
 STRAP_COLOR = (125, 125, 125)
 STRAP_WIDTH = 5
-
-box_breaking_sound = sweeperlib.pyglet.media.load("sounds/box_breaking_sound.wav", streaming=False)
-duck_sound = sweeperlib.pyglet.media.load("sounds/duck_sound.wav", streaming=False)
-bounce_sound = sweeperlib.pyglet.media.load("sounds/bounce_sound.wav", streaming=False)
-
-game = {
-    "x": LAUNCH_X,
-    "y": LAUNCH_Y,
-    "w": 40,
-    "h": 40,
-    "angle": 0,
-    "force": 0,
-    "x_velocity": 0,
-    "y_velocity": 0,
-    "flight": False,
+AIM_DOTS = 15
+AIM_DOT_RADIUS = 3
+AIM_DOT_COLOR = (255, 255, 255)
+# Physics steps per second. Independent of the drawing rate, can be raised to
+# e.g. 120 or 240 on machines that have the CPU to spare.
+PHYSICS_RATE = 60
+# The longest time the physics catches up in one update, in seconds. If the
+# game falls further behind than this, the rest is skipped.
+MAX_CATCH_UP = 0.25
+# The normal level that P starts from the menu
+FIRST_LEVEL = "level1.json"
+# The run's replay is saved here when the game is closed
+REPLAY_FILE = "replay.json"
+# The profiler's records are dumped here with F4
+PROFILE_FILE = "profile.csv"
+# How often the profiling overlay's numbers are updated, in seconds
+OVERLAY_INTERVAL = 0.25
+
+# Sounds played for the events emitted by the simulation, named after the
+# events, and how many of each can play at the same time
+mixer = audio.create_mixer(audio.pyglet_backend())
+audio.load(mixer, "launch", "sounds/duck_sound.wav", limit=1)
+audio.load(mixer, "bounce", "sounds/bounce_sound.wav", limit=2)
+audio.load(mixer, "box_broken", "sounds/box_breaking_sound.wav", limit=4)
+
+game = levels.create_game(random.randrange(2 ** 32))
+game.update({
     "mouse_down": False,
-    "level": "menu",
-    "boxes": [],
-    "ducks": 0,
-    "next_level": None,
     "time": 0.0,
-    "random_levels_passed": 0,
-    "used_ducks": [],
     "fullscreen": True,
-    "slow_duck": 0
-}
+    "accumulator": 0.0,
+    "alpha": 0.0,
+    "first_level": FIRST_LEVEL
+})
+
+# The commands of the run, played back with replay.py
+recording = replay.create_replay(game["seed"], PHYSICS_RATE)
+
+# Tick and frame timings, recorded while the overlay is shown (F3)
+profile = profiler.create_profiler()
+profile.update({
+    "overlay": [],
+    "overlay_time": 0.0
+})
+
+# The trajectories of the aiming dots
+aim_table = aiming.create_table(AIM_DOTS)
 
 animation = {
     "animation_time": 0.0,
@@ -90,576 +113,56 @@ animation = {
 }
 
 
-############################## Math functions ##############################
-
-
-def calculate_distance(x1, y1, x2, y2):
-    """
-    Returns the distance between two points.
-
-    :Parameters:
-        `x1` : float
-            X-coordinate of the first point.
-        `y1` : float
-            Y-coordinate of the first point.
-        `x1` : float
-            X-coordinate of the second point.
-        `y1` : float
-            Y-coordinate of the second point.
-    """
-    return math.sqrt(pow(x2 - x1, 2) + pow(y2 - y1, 2))
-
-
-def calculate_angle(x1, y1, x2, y2):
-    """
-    Returns the radian angle between two points.
-
-    :Parameters:
-        `x1` : float
-            X-coordinate of the first point.
-        `y1` : float
-            Y-coordinate of the first point.
-        `x1` : float
-            X-coordinate of the second point.
-        `y1` : float
-            Y-coordinate of the second point.
-    """
-    x_distance = x2 - x1
-    y_distance = y2 - y1
-    return math.atan2(y_distance, x_distance)
-
-
-def convert_to_xy(angle, ray):
-    """
-    Converts polar coordinates to cartesian coordinates and returns them.
-
-    :Parameters:
-        `angle` : float
-            The radian angle from the reference angle.
-        `ray` : float
-            The distance from the reference point.
-    """
-    x = ray * math.cos(angle)
-    y = ray * math.sin(angle)
-    return x, y
-
-
-def clamp_inside_circle(x, y, circle_center_x, circle_center_y, radius):
-    """
-    First the function finds out whether the given
-    point is already inside the circle. If it is, its coordinates
-    are simply returned as they are. However, if the point is outside
-    the circle, it is "pulled" to the circle's perimeter and then returned.
-
-    :Parameters:
-        `x` : float
-            X-coordinate of the point.
-        `y` : float
-            Y-coordinate of the point.
-        `circle_center_x` : float
-            X-coordinate of the circle's center.
-        `circle_center_x` : float'
-            Y-coordinate of the circle's center.
-        `radius` : float
-            Radius of the circle.
-    """
-    distance = calculate_distance(x, y, circle_center_x, circle_center_y)
-    if distance > radius:
-        angle = calculate_angle(x, y, circle_center_x, circle_center_y)
-        ray = distance - radius
-        move_x, move_y = convert_to_xy(angle, ray)
-        return x + move_x, y + move_y
-    return x, y
-
-
 ############################## Game related auxiliary functions ##############################
 
 
-def order_by_height(box):
+def queue_event_sounds():
     """
-    Used to sort the list of boxes according to their height measured from the top of the box.
-
-    :Parameters:
-        `box` : A `dict` with the following keys:
-                    x `float` : X-coordinate of the box.
-                    y `float` : Y-coordinate of the box.
-                    w `float` : Width of the box.
-                    h `float` : Height of the box.
-    """
-    return box["y"] + box["h"]
-
-
-def order_by_distance(collision):
-    """
-    Used to sort the list of colliding boxes according to their distance from the duck.
-
-    :Parameters:
-        `box` : A `dict` with the following keys:
-                    x `float` : X-coordinate of the box.
-                    y `float` : Y-coordinate of the box.
-                    w `float` : Width of the box.
-                    h `float` : Height of the box.
-    """
-    return calculate_distance(game["x"], game["y"], collision["x"], collision["y"])
-
-
-def update_position():
-    """Updates the duck's position when using arrow keys to adjust angle and force."""
-    x, y = convert_to_xy(math.radians(game["angle"]), game["force"])
-    game["x"] = LAUNCH_X - x
-    game["y"] = LAUNCH_Y - y
-
-
-def targets_remaining():
-    """Checks if there are any targets left in the list of boxes."""
-    for box in game["boxes"]:
-        if box["type"] == "target":
-            return True
-    return False
-
-
-def is_inside_area(min_x, max_x, min_y, max_y, box):
+    Queues the sounds for the events the simulation has emitted since the last
+    call. They are played once per frame in update.
     """
-    Checks whether the `box` is inside the area defined
-    by the minimum and maximum x and y values.
+    for event in physics.pop_events(game):
+        audio.queue(mixer, event[0])
 
-    :Parameters:
-        `min_x` : float
-            Minimum x value of the area.
-        `max_x` : float
-            Maximum x value of the area.
-        `min_y` : float
-            Minimum y value of the area.
-        `max_y` : float
-            Maximum y value of the area.
-        `box` : A `dict` with the following keys:
-                    x `float` : X-coordinate of the box.
-                    y `float` : Y-coordinate of the box.
-                    w `float` : Width of the box.
-                    h `float` : Height of the box.
-    """
-    if max_y < box["y"] or min_y > box["y"] + box["h"]:
-        return False
-    if max_x < box["x"] or min_x > box["x"] + box["w"]:
-        return False
-    return True
 
-
-def initial_state():
+def command(*args):
     """
-    Puts the game back into its initial state: the duck is put back into the
-    launch position, its speed to zero, and its flight state to False.
+    Carries out a command that changes the simulation and records it into the
+    run's replay. See replay.apply_command for the commands.
     """
-    game["x"] = LAUNCH_X
-    game["y"] = LAUNCH_Y
-    game["angle"] = 0
-    game["force"] = 0
-    game["x_velocity"] = 0
-    game["y_velocity"] = 0
-    game["flight"] = False
+    replay.record(recording, game, args)
 
 
-def launch():
-    """
-    Launches a duck and calculates its starting velocity. Stores x- and y-velocity
-    components to the game dictionary. Removes one duck.
-    """
-    if not game["flight"]:
-        game["x_velocity"] = game["force"] * FORCE_FACTOR * math.cos(math.radians(game["angle"]))
-        game["y_velocity"] = game["force"] * FORCE_FACTOR * math.sin(math.radians(game["angle"]))
-        game["flight"] = True
-        game["ducks"] -= 1
-        duck_sound.play()
+def profile_lap(phase):
+    """Records the time of a tick's or frame's phase into the profiler."""
+    profiler.lap(profile, phase)
 
 
-def create_boxes(quantity):
+def update_overlay():
     """
-    Creates a speficied number of boxes with random positions inside the specified
-    area. Boxes are represented as dictionaries with the following keys:
-    type: either "target" or "obstacle"
-    x: x coordinate of the bottom left corner
-    y: y coordinate of the bottom left corner
-    w: box width
-    h: box height
-    vy: falling velocity of the box
-    To make the random levels easier to pass, the target boxes are
-    spawned higher than obstacles.
-
-    :Parameters:
-        `quantity` : int
-            The number of boxes to create. Preferably an even number.
+    Updates the lines of the profiling overlay from the latest second of
+    records. The lines are only updated a few times per second, so that the
+    text doesn't flicker and the labels aren't recreated every frame.
     """
-    boxlist = []
-    for i in range(quantity):
-        if i < quantity / 2:
-            box = {
-                "type": "target",
-                "x": random.randint(WIN_WIDTH - 880, WIN_WIDTH - 60),
-                "y": random.randint(340, 600),
-                "w": 40,
-                "h": 40,
-                "vy": 0
-            }
-        else:
-            box = {
-                "type": "obstacle",
-                "x": random.randint(WIN_WIDTH - 880, WIN_WIDTH - 60),
-                "y": random.randint(80, 300),
-                "w": 40,
-                "h": 40,
-                "vy": 0
-            }
-        boxlist.append(box)
-        boxlist.sort(key=order_by_height)
-
-    return boxlist
-
-
-def drop_boxes(boxes):
-    """
-    Drops rectangular objects that are given as a list. Each object is to be
-    defined as a dictionary with x and y coordinates, width, height, and falling
-    velocity. Drops boxes for one time unit.
-    :Parameters:
-        `boxes` : A `list` of `dict`s that describe boxes.
-                  The dictionaries must have x, y, w, h and vy keys.
-    """
-    boxes.sort(key=order_by_height)
-    try:
-        boxes[0]["initial_height"]
-    except KeyError:
-        for box in game["boxes"]:
-            box["initial_height"] = box["y"] + box["h"]
-    for box in game["boxes"]:
-        if box["y"] <= GROUND_LEVEL:
-            box["y"] = GROUND_LEVEL
-            box["vy"] = 0
-            continue
-
-        allow_falling = True
-        for other in game["boxes"]:
-            if box == other:
-                continue
-            if box["initial_height"] < other["initial_height"]:
-                continue
-            if box["initial_height"] == other["initial_height"]:
-                box["initial_height"] += 1
-            if is_inside_area(box["x"], box["x"] + box["w"], box["y"], box["y"] + box["h"], other):
-                if (not box["x"] == other["x"] + other["w"] and
-                    not box["x"] + box["w"] == other["x"]):
-                    box["y"] = other["y"] + other["h"]
-                    box["vy"] = 0
-                    allow_falling = False
-
-        if allow_falling:
-            box["vy"] += GRAVITATIONAL_ACCEL
-            box["y"] -= box["vy"]
-
-
-def drop_ducks(ducks):
-    """
-    Makes used ducks fall down and destroy targets.
-
-    :Parameters:
-        `ducks` : A `list` of `dict`s that describe ducks.
-                  The dictionaries must have x, y, w, h and vy values.
-    """
-    for duck in ducks:
-        destroy_targets(duck)
-        if duck["y"] <= GROUND_LEVEL:
-            duck["y"] = GROUND_LEVEL
-            continue
-        allow_falling = True
-        for box in game["boxes"]:
-            if is_inside_area(duck["x"],
-                              duck["x"] + duck["w"],
-                              duck["y"],
-                              duck["y"] + duck["h"],
-                              box):
-                duck["y"] = box["y"] + box["h"]
-                duck["vy"] = 0
-                allow_falling = False
-        if allow_falling:
-            duck["vy"] -= GRAVITATIONAL_ACCEL
-            duck["y"] += duck["vy"]
-
-
-def destroy_targets(duck):
-    """
-    Destroys targets that are overlapping the duck.
-
-    :Parameters:
-        `duck` : A `dict` describing a duck.
-                 Has to have x, y, w and h values.
-    """
-    new_box_list = []
-    for box in game["boxes"]:
-        if is_inside_area(duck["x"], duck["x"] + duck["w"], duck["y"], duck["y"] + duck["h"], box):
-            if box["type"] == "target":
-                box_breaking_sound.play()
-                continue
-            new_box_list.append(box)
-        else:
-            new_box_list.append(box)
-    game["boxes"] = new_box_list
-
-
-def predict_collisions():
-    """
-    Checks whether the duck collides or is about to collide with boxes.
-    If the duck collides with an obstacle, it bounces off it if the circumstances are right.
-    """
-    collisions = []
-    bounce_from = None
-
-    # Duck's direction: down and right
-    if game["y_velocity"] <= 0 and game["x_velocity"] >= 0:
-        for box in game["boxes"]:
-            if is_inside_area(game["x"],
-                              game["x"] + game["x_velocity"] + game["w"],
-                              game["y"] + game["y_velocity"],
-                              game["y"] + game["h"],
-                              box):
-                collisions.append(box)
-    # Duck's direction: down and left
-    elif game["y_velocity"] <= 0 and game["x_velocity"] <= 0:
-        for box in game["boxes"]:
-            if is_inside_area(game["x"] + game["x_velocity"],
-                              game["x"] + game["w"],
-                              game["y"] + game["y_velocity"],
-                              game["y"] + game["h"],
-                              box):
-                collisions.append(box)
-    # Duck's direction: up and right
-    elif game["y_velocity"] >= 0 and game["x_velocity"] >= 0:
-        for box in game["boxes"]:
-            if is_inside_area(game["x"],
-                              game["x"] + game["x_velocity"] + game["w"],
-                              game["y"],
-                              game["y"] + game["y_velocity"] + game["h"],
-                              box):
-                collisions.append(box)
-    # Duck's direction: up and left
-    elif game["y_velocity"] >= 0 and game["x_velocity"] <= 0:
-        for box in game["boxes"]:
-            if is_inside_area(game["x"] + game["x_velocity"],
-                              game["x"] + game["w"],
-                              game["y"],
-                              game["y"] + game["y_velocity"] + game["h"],
-                              box):
-                collisions.append(box)
-
-    if collisions:
-        collisions.sort(key=order_by_distance)
-        # Find the closest box
-        for collision in collisions:
-            if collision["type"] == "obstacle":
-                bounce_from = collision
-                break
-        collisions.clear()
-        if not bounce_from:
-            return
-    else:
-        return
-
-    angle = calculate_angle(game["x"],
-                            game["y"],
-                            game["x"] + game["x_velocity"],
-                            game["y"] + game["y_velocity"])
-
-    # When bouncing left
-    if game["x_velocity"] >= 0 and game["x"] + game["w"] <= bounce_from["x"]:
-        try:
-            ray = abs((bounce_from["x"] - game["w"] - game["x"]) / math.cos(angle))
-        except ZeroDivisionError:
-            ray = abs(game["y"] - bounce_from["y"])
-        if try_to_bounce(angle, ray, bounce_from, "x_velocity"):
-            return
-
-    # When bouncing right
-    elif game["x_velocity"] <= 0 and game["x"] >= bounce_from["x"] + bounce_from["w"]:
-        try:
-            ray = abs((game["x"] - bounce_from["x"] - bounce_from["w"]) / math.cos(angle))
-        except ZeroDivisionError:
-            ray = abs(game["y"] - bounce_from["y"])
-        if try_to_bounce(angle, ray, bounce_from, "x_velocity"):
-            return
-
-    # When bouncing up
-    if game["y_velocity"] <= 0 and game["y"] >= bounce_from["y"] + bounce_from["h"]:
-        try:
-            ray = abs((game["y"] - bounce_from["y"] - bounce_from["h"]) / math.sin(angle))
-        except ZeroDivisionError:
-            ray = abs(game["x"] - bounce_from["x"])
-        if try_to_bounce(angle, ray, bounce_from, "y_velocity"):
-            return
-
-
-def try_to_bounce(angle, ray, bounce_from, velocity_axis):
-    """
-    Tests if the duck should bounce off the bounce_from -obstacle in
-    the direction defined by velocity_axis.
-
-    :Parameters:
-        `angle` : float
-            The direction to which the duck is currently heading, in radians.
-        `ray` : float
-            The distance from duck's current position to the assumed next position.
-        `bounce_from` : A `dict` which describes a box.
-            Has x, y, w and h values.
-        `velocity_axis` : str
-            Either "x_velocity" or "y_velocity".
-    :Returns:
-    `True`, if the duck bounces off the bounce_from -obstacle.
-    `False` otherwise.
-    """
-    x_movement, y_movement = convert_to_xy(angle, ray)
-    test_box = {"x": game["x"] + x_movement,
-                "y": game["y"] + y_movement,
-                "w": game["w"],
-                "h": game["h"]
-                }
-    if is_inside_area(test_box["x"],
-                      test_box["x"] + test_box["w"],
-                      test_box["y"],
-                      test_box["y"] + test_box["h"],
-                      bounce_from):
-        game["x"] = test_box["x"]
-        game["y"] = test_box["y"]
-        if velocity_axis == "x_velocity":
-            game[velocity_axis] = game[velocity_axis] * -ELASTICITY
-        elif velocity_axis == "y_velocity":
-            game[velocity_axis] = game[velocity_axis] * -ELASTICITY
-            game["x_velocity"] = game["x_velocity"] * ELASTICITY
-        if abs(game["x_velocity"]) > 1 or abs(game["y_velocity"]) > 2:
-            bounce_sound.play()
-        return True
-    return False
-
-
-def check_overlaps():
-    """
-    Checks if the duck is currently overlapping with an obstacle.
-    If it is, it bounces into an appropriate direction from the obstacle.
-    """
-    overlapping_box = None
-
-    for box in game["boxes"]:
-        if is_inside_area(game["x"], game["x"] + game["w"], game["y"], game["y"] + game["h"], box):
-            if box["type"] == "obstacle":
-                overlapping_box = box
-                break
-
-    if not overlapping_box:
+    if game["time"] < profile["overlay_time"] + OVERLAY_INTERVAL:
         return
-
-    angle = calculate_angle(game["x"],
-                            game["y"],
-                            game["x"] + game["x_velocity"],
-                            game["y"] + game["y_velocity"])
-
-    # When bouncing left
-    if game["x_velocity"] >= 0 and not check_adjacent_boxes(overlapping_box, "left"):
-        try:
-            ray = abs((overlapping_box["x"] - game["w"] - game["x"]) / math.cos(angle))
-        except ZeroDivisionError:
-            ray = abs(game["y"] - overlapping_box["y"])
-        if try_to_bounce(angle, ray, overlapping_box, "x_velocity"):
-            return
-
-    # When bouncing right
-    elif game["x_velocity"] <= 0 and not check_adjacent_boxes(overlapping_box, "right"):
-        try:
-            ray = abs((game["x"] - overlapping_box["x"] - overlapping_box["w"]) / math.cos(angle))
-        except ZeroDivisionError:
-            ray = abs(game["y"] - overlapping_box["y"])
-        if try_to_bounce(angle, ray, overlapping_box, "x_velocity"):
-            return
-
-    # When bouncing up
-    if game["y_velocity"] <= 0 and not check_adjacent_boxes(overlapping_box, "up"):
-        try:
-            ray = abs((game["y"] - overlapping_box["y"] - overlapping_box["h"]) / math.sin(angle))
-        except ZeroDivisionError:
-            ray = abs(game["x"] - overlapping_box["x"])
-        if try_to_bounce(angle, ray, overlapping_box, "y_velocity"):
-            return
-
-
-def check_adjacent_boxes(box, side):
-    """
-    Checks if there is an adjacent box on certain side of the box.
-
-    :Parameters:
-        `box`: A `dict` describing a box.
-            Has x, y, w and h values.
-        `side` : str
-            "left", "right" or "up".
-    :Returns:
-        `True`, if there is an adjacent box on the side specified by the side parameter.
-        `False` otherwise.
-    """
-    for other in game["boxes"]:
-        if side == "left":
-            if (box["y"] == other["y"] or
-                    box["y"] + box["h"] == other["y"] + other["h"] and
-                    box["x"] == other["x"] + other["w"]):
-                return True
-        elif side == "right":
-            if (box["y"] == other["y"] or
-                    box["y"] + box["h"] == other["y"] + other["h"] and
-                    box["x"] + box["w"] == other["x"]):
-                return True
-        elif side == "up":
-            if (box["y"] + box["h"] == other["y"] and
-                    (box["x"] == other["x"] or
-                     box["x"] + box["w"] == other["x"] + other["w"])):
-                return True
-    return False
-
-
-def load_level(level):
-    """
-    Loads a level.
-
-    :Parameters:
-        `level` : str
-            A String that tells the program which level to load.
-            Possible values:
-            "levelX.json", where X is a normal level's number.
-            "levelX", where X is a random level's number.
-            "win", when the player passes all normal levels.
-    """
-    game["used_ducks"].clear()
-    # If the player wins the game
-    if level == "win":
-        game["level"] = level
-    # Normal levels
-    elif level.endswith(".json"):
-        try:
-            with open(level) as file:
-                data = json.load(file)
-                game["level"] = level
-                game["boxes"] = data["boxes"].copy()
-                game["ducks"] = data["ducks"]
-                game["next_level"] = data["next_level"]
-        except IOError:
-            print("Failed to load level.")
-    # Random levels
-    else:
-        level_number = ""
-        for c in level:
-            if c.isdigit():
-                level_number += c
-        level_number = int(level_number)
-        game["boxes"] = create_boxes(level_number * 2)
-        game["level"] = level
-        if level_number <= 8:
-            game["ducks"] = len(game["boxes"])
-        else:
-            game["ducks"] = 16
-        game["next_level"] = "level{}".format(level_number + 1)
-        game["random_levels_passed"] = level_number - 1
+    profile["overlay_time"] = game["time"]
+    ticks = profiler.recent(profile, "tick")
+    frames = profiler.recent(profile, "frame")
+    profile["overlay"] = [
+        "FPS: {}  ticks/s: {}".format(len(frames), len(ticks)),
+        "tick: {:.2f} ms (boxes {:.2f}, ducks {:.2f}, flight {:.2f})".format(
+            profiler.average(ticks),
+            profiler.average(ticks, "drop_boxes"),
+            profiler.average(ticks, "drop_ducks"),
+            profiler.average(ticks, "fly_duck")),
+        "draw: {:.2f} ms (prepare {:.2f}, draw {:.2f})".format(
+            profiler.average(frames),
+            profiler.average(frames, "prepare"),
+            profiler.average(frames, "draw")),
+        "boxes: {}  sprites: {}".format(len(game["boxes"]), len(sweeperlib.graphics["sprites"])),
+        "F4: save to {}".format(PROFILE_FILE)
+    ]
 
 
 def initialize_extras():
@@ -668,43 +171,55 @@ def initialize_extras():
     directly using the sweeperlib or are otherwise better to add this way.
     This includes some extra sprites, custom background, lines as straps and fullscreen.
     """
-    sweeperlib.graphics["images"]["duck2"] = sweeperlib.pyglet.resource.image("duck2.png")
-    sweeperlib.graphics["images"]["target"] = sweeperlib.pyglet.resource.image("target.png")
-    sweeperlib.graphics["images"]["obstacle"] = sweeperlib.pyglet.resource.image("obstacle.png")
-    sweeperlib.graphics["background"] = sweeperlib.pyglet.sprite.Sprite(
-                                            sweeperlib.pyglet.resource.image("background.png"))
-    sweeperlib.graphics["lines"] = []
+    sweeperlib.load_images({
+        "duck2": "duck2.png",
+        "target": "target.png",
+        "obstacle": "obstacle.png"
+    })
+    sweeperlib.load_background("background.png")
+    # The first batch is drawn before the sprites, so the straps and the
+    # aiming dots in it render behind them. The shapes are created once and
+    # only moved after that.
+    sweeperlib.graphics["first_batch"] = sweeperlib.pyglet.graphics.Batch()
+    sweeperlib.graphics["straps"] = []
+    for anchor_x in (LAUNCH_X - 16, LAUNCH_X + 55):
+        sweeperlib.graphics["straps"].append(
+            sweeperlib.pyglet.shapes.Line(anchor_x,
+                                          LAUNCH_Y + 43,
+                                          LAUNCH_X + 20,
+                                          LAUNCH_Y + 40,
+                                          width=STRAP_WIDTH,
+                                          color=STRAP_COLOR,
+                                          batch=sweeperlib.graphics["first_batch"]))
+    sweeperlib.graphics["aim_dots"] = []
+    for _ in range(AIM_DOTS):
+        dot = sweeperlib.pyglet.shapes.Circle(0, 0,
+                                              AIM_DOT_RADIUS,
+                                              color=AIM_DOT_COLOR,
+                                              batch=sweeperlib.graphics["first_batch"])
+        dot.visible = False
+        sweeperlib.graphics["aim_dots"].append(dot)
     sweeperlib.graphics["window"].set_fullscreen(fullscreen=True)
 
 
-def prepare_line(x1, y1, x2, y2, width=1, color=(255, 255, 255)):
+def move_straps(x, y):
     """
-    Adds a line shape sprite to the first batch.
-    Lines have to be in the first batch for them to
-    render behind other sprites.
+    Moves the loose ends of the sling's straps to the given point and shows
+    the straps. The straps are only updated if the point has changed.
 
     :Parameters:
-    `x1` : float
-        The first X coordinate of the line.
-    `y1` : float
-        The first Y coordinate of the line.
-    `x2` : float
-        The second X coordinate of the line.
-    `y2` : float
-        The second Y coordinate of the line.
-    `width` : float
-        The desired width of the line.
-    `color` : (int, int, int)
-        The RGB color of the line, specified as a tuple of three ints in the range of 0-255.
+    `x` : float
+        The X coordinate where the straps meet.
+    `y` : float
+        The Y coordinate where the straps meet.
     """
-    sweeperlib.graphics["lines"].append(
-        sweeperlib.pyglet.shapes.Line(x1,
-                                      y1,
-                                      x2,
-                                      y2,
-                                      width=width,
-                                      color=color,
-                                      batch=sweeperlib.graphics["first_batch"]))
+    for strap in sweeperlib.graphics["straps"]:
+        if not strap.visible:
+            strap.visible = True
+        if strap.x2 != x:
+            strap.x2 = x
+        if strap.y2 != y:
+            strap.y2 = y
 
 
 ############################## Handler functions ##############################
@@ -712,15 +227,15 @@ def prepare_line(x1, y1, x2, y2, width=1, color=(255, 255, 255)):
 
 def draw_handler():
     """This function draws everything in the game."""
+    profiler.begin(profile, "frame")
     sweeperlib.clear_window()
     sweeperlib.draw_background()
     sweeperlib.begin_sprite_draw()
-    # An extra batch for the lines (straps)
-    sweeperlib.graphics["first_batch"] = sweeperlib.pyglet.graphics.Batch()
+    profile_lap("background")
 
     if game["level"] == "menu":
         sweeperlib.draw_text("A Wee Bit Miffed Ducks", 40, WIN_HEIGHT - 150, size=40)
-        sweeperlib.prepare_sprite("duck", 650, WIN_HEIGHT - 140)
+        sweeperlib.prepare_sprite("duck", 650, WIN_HEIGHT - 140, owner="duck")
         sweeperlib.draw_text("Play levels: P", 40, 354)
         sweeperlib.draw_text("Play random levels: R", 40, 282)
         sweeperlib.draw_text("Quit: Q", 40, 210)
@@ -746,7 +261,7 @@ def draw_handler():
         sweeperlib.draw_text("M: Menu", 40, WIN_HEIGHT/2 - 144)
         sweeperlib.draw_text("Q: Quit", 40, WIN_HEIGHT/2 - 216)
 
-    elif game["level"].startswith("level"):
+    elif levels.is_playing(game["level"]):
         if game["flight"]:
             # Duck animation
             if game["time"] >= animation["animation_time"] + 0.1:
@@ -755,82 +270,68 @@ def draw_handler():
                     animation["frame"] = "duck2"
                 elif animation["frame"] == "duck2":
                     animation["frame"] = "duck"
-            # Straps
-            prepare_line(LAUNCH_X - 16,
-                         LAUNCH_Y + 43,
-                         LAUNCH_X + 20,
-                         LAUNCH_Y + 40,
-                         STRAP_WIDTH,
-                         STRAP_COLOR)
-            prepare_line(LAUNCH_X + 55,
-                         LAUNCH_Y + 43,
-                         LAUNCH_X + 20,
-                         LAUNCH_Y + 40,
-                         STRAP_WIDTH,
-                         STRAP_COLOR)
-            sweeperlib.prepare_sprite(animation["frame"], game["x"], game["y"])
+            # The straps and the aiming dots are hidden until the next aim
+            for shape in sweeperlib.graphics["straps"] + sweeperlib.graphics["aim_dots"]:
+                if shape.visible:
+                    shape.visible = False
+            duck_x, duck_y = physics.duck_render_position(game, game["alpha"])
+            sweeperlib.prepare_sprite(animation["frame"], duck_x, duck_y, owner="duck")
         else:
+            duck = game["duck"]
             # Straps
-            prepare_line(LAUNCH_X - 16,
-                         LAUNCH_Y + 43,
-                         game["x"] + 20,
-                         game["y"] + 10,
-                         STRAP_WIDTH,
-                         STRAP_COLOR)
-            prepare_line(LAUNCH_X + 55,
-                         LAUNCH_Y + 43,
-                         game["x"] + 20,
-                         game["y"] + 10,
-                         STRAP_WIDTH,
-                         STRAP_COLOR)
-            sweeperlib.prepare_sprite("duck", game["x"], game["y"])
+            move_straps(duck.x + 20, duck.y + 10)
+            sweeperlib.prepare_sprite("duck", duck.x, duck.y, owner="duck")
             # Aiming points
             if game["mouse_down"] or game["force"] > 0:
-                point_x = game["x"]
-                point_y = game["y"]
-                point_xv = game["force"] * FORCE_FACTOR * math.cos(math.radians(game["angle"]))
-                point_yv = game["force"] * FORCE_FACTOR * math.sin(math.radians(game["angle"]))
-                for i in range(15):
-                    sweeperlib.draw_text("o",
-                                         point_x + 20,
-                                         point_y + 20,
-                                         color=(255, 255, 255, 255),
-                                         size=10)
-                    point_x += point_xv
-                    point_y += point_yv
-                    point_yv -= GRAVITATIONAL_ACCEL
+                points = aiming.preview(aim_table, game)
+            else:
+                points = []
+            for i, dot in enumerate(sweeperlib.graphics["aim_dots"]):
+                visible = i < len(points)
+                if dot.visible != visible:
+                    dot.visible = visible
+                if visible:
+                    dot.position = (points[i][0] + 24, points[i][1] + 24)
 
         # Sling
-        sweeperlib.prepare_sprite("sling", LAUNCH_X - 20, GROUND_LEVEL)
+        sweeperlib.prepare_sprite("sling", LAUNCH_X - 20, GROUND_LEVEL, owner="sling")
 
         # Boxes
         for box in game["boxes"]:
-            if box["type"] == "target":
-                sweeperlib.prepare_sprite("target", box["x"], box["y"])
-            elif box["type"] == "obstacle":
-                sweeperlib.prepare_sprite("obstacle", box["x"], box["y"])
+            box_x, box_y = physics.render_position(game, box, game["alpha"])
+            if box.type == "target":
+                sweeperlib.prepare_sprite("target", box_x, box_y, owner=id(box))
+            elif box.type == "obstacle":
+                sweeperlib.prepare_sprite("obstacle", box_x, box_y, owner=id(box))
 
         # Remaining ducks
         for i in range(game["ducks"] - 1):
-            sweeperlib.prepare_sprite("duck", 40 + i * 50, 20)
+            sweeperlib.prepare_sprite("duck", 40 + i * 50, 20, owner=("ducks_left", i))
 
         # Used ducks
         for duck in game["used_ducks"]:
-            sweeperlib.prepare_sprite("duck", duck["x"], duck["y"])
+            duck_x, duck_y = physics.render_position(game, duck, game["alpha"])
+            sweeperlib.prepare_sprite("duck", duck_x, duck_y, owner=id(duck))
 
-        # Straps
+        # Straps and aiming dots
         sweeperlib.graphics["first_batch"].draw()
-        sweeperlib.graphics["lines"].clear()
 
         # Info texts
         sweeperlib.draw_text("Level: {} Angle: {:.1f}° Force: {:.0f} Ducks: {}".format(
-                game["level"].lstrip("level").rstrip(".json"),
+                os.path.splitext(os.path.basename(game["level"]))[0].lstrip("level"),
                 game["angle"],
                 game["force"],
                 game["ducks"]
                 ), 40, WIN_HEIGHT - 100, size=20)
 
+    if profile["enabled"]:
+        update_overlay()
+        for i, line in enumerate(profile["overlay"]):
+            sweeperlib.draw_text(line, WIN_WIDTH - 640, WIN_HEIGHT - 40 - i * 24, size=14)
+    profile_lap("prepare")
     sweeperlib.draw_sprites()
+    profile_lap("draw")
+    profiler.end(profile)
 
 
 def drag_handler(mouse_x, mouse_y, dx, dy, mouse_button, modifier_keys):
@@ -838,17 +339,18 @@ def drag_handler(mouse_x, mouse_y, dx, dy, mouse_button, modifier_keys):
     This function is called when the mouse is moved while one of its buttons is
     pressed down. This is used to drag the duck.
     """
-    if not game["flight"] and game["level"].startswith("level"):
+    if not game["flight"] and levels.is_playing(game["level"]):
+        duck = game["duck"]
         game["mouse_down"] = True
-        game["x"] += dx
-        game["y"] += dy
-        game["x"], game["y"] = clamp_inside_circle(game["x"],
-                                                   game["y"],
-                                                   LAUNCH_X,
-                                                   LAUNCH_Y,
-                                                   DRAG_RADIUS)
-        game["angle"] = math.degrees(calculate_angle(game["x"], game["y"], LAUNCH_X, LAUNCH_Y))
-        game["force"] = math.sqrt(pow(game["x"] - LAUNCH_X, 2) + pow(game["y"] - LAUNCH_Y, 2))
+        duck.x += dx
+        duck.y += dy
+        duck.x, duck.y = physics.clamp_inside_circle(duck.x,
+                                                     duck.y,
+                                                     LAUNCH_X,
+                                                     LAUNCH_Y,
+                                                     DRAG_RADIUS)
+        game["angle"] = math.degrees(physics.calculate_angle(duck.x, duck.y, LAUNCH_X, LAUNCH_Y))
+        game["force"] = math.sqrt(pow(duck.x - LAUNCH_X, 2) + pow(duck.y - LAUNCH_Y, 2))
 
 
 def mouse_release_handler(x, y, button, modifiers):
@@ -857,12 +359,13 @@ def mouse_release_handler(x, y, button, modifiers):
     The function determines the angle and the force with which
     the duck will be launched and launches it.
     """
-    if not game["flight"] and game["level"].startswith("level") and game["force"] >= 5:
-        game["angle"] = math.degrees(calculate_angle(game["x"], game["y"], LAUNCH_X, LAUNCH_Y))
-        game["force"] = math.sqrt(pow(game["x"] - LAUNCH_X, 2) + pow(game["y"] - LAUNCH_Y, 2))
-        launch()
-    elif not game["flight"] and game["level"].startswith("level") and game["force"] <= 5:
-        initial_state()
+    duck = game["duck"]
+    if not game["flight"] and levels.is_playing(game["level"]) and game["force"] >= 5:
+        game["angle"] = math.degrees(physics.calculate_angle(duck.x, duck.y, LAUNCH_X, LAUNCH_Y))
+        game["force"] = math.sqrt(pow(duck.x - LAUNCH_X, 2) + pow(duck.y - LAUNCH_Y, 2))
+        command("launch", duck.x, duck.y, game["angle"], game["force"])
+    elif not game["flight"] and levels.is_playing(game["level"]) and game["force"] <= 5:
+        physics.initial_state(game)
     game["mouse_down"] = False
 
 
@@ -874,8 +377,15 @@ def keyboard_handler(symbol, modifiers):
         sweeperlib.close()
 
     if symbol == key.M:
-        initial_state()
-        game["level"] = "menu"
+        command("menu")
+
+    if symbol == key.F3:
+        profile["enabled"] = not profile["enabled"]
+        profile["overlay_time"] = 0.0
+        profile["overlay"] = []
+
+    if symbol == key.F4:
+        profiler.dump(profile, PROFILE_FILE)
 
     if symbol == key.F:
         if game["fullscreen"]:
@@ -888,82 +398,103 @@ def keyboard_handler(symbol, modifiers):
     # Menu keys
     if game["level"] == "menu":
         if symbol == key.P:
-            load_level("level1.json")
+            command("load", game["first_level"])
         if symbol == key.R:
-            load_level("level1")
+            command("load", "level1")
 
     # Game keys
-    if game["level"].startswith("level") and not game["flight"]:
-        if game["level"].endswith(".json") or game["level"].endswith("1"):
+    if levels.is_playing(game["level"]) and not game["flight"]:
+        if levels.can_restart(game["level"]):
             if symbol == key.R:
-                initial_state()
-                load_level(game["level"])
+                command("load", game["level"])
 
         if symbol == key.RIGHT:
             game["angle"] -= 5
             if game["angle"] < -175:
                 game["angle"] = game["angle"] * -1
-            update_position()
+            physics.update_position(game)
         elif symbol == key.LEFT:
             game["angle"] += 5
             if game["angle"] > 180:
                 game["angle"] = game["angle"] * -1 + 10
-            update_position()
+            physics.update_position(game)
 
         if symbol == key.UP:
             if game["force"] < 100:
                 game["force"] += 5
             elif game["force"] == 100:
                 game["force"] = 0
-            update_position()
+            physics.update_position(game)
         elif symbol == key.DOWN:
             if game["force"] >= 5:
                 game["force"] -= 5
             elif game["force"] == 0:
                 game["force"] = 100
-            update_position()
+            physics.update_position(game)
 
         if symbol == key.SPACE:
-            launch()
+            command("launch", game["duck"].x, game["duck"].y, game["angle"], game["force"])
+
+
+def tick():
+    """Advances the game by one physics step and moves on to the next level when needed."""
+    profiler.begin(profile, "tick")
+    levels.advance(game, 1 / PHYSICS_RATE, profile_lap)
+    queue_event_sounds()
+    profile_lap("sounds")
+    profiler.end(profile)
 
 
 def update(elapsed):
-    """This is called 60 times/second."""
+    """
+    This is called 60 times/second. Runs as many fixed-length physics steps
+    as fit into the elapsed time, so the game runs at the correct speed even
+    when frames are late. The leftover time is carried over to the next call,
+    and the drawing code uses it to interpolate positions between steps.
+    The sounds queued by the steps are played after them.
+
+    The window is only drawn again when something has changed, see
+    request_redraw.
+    """
     game["time"] += elapsed
-    if game["level"].startswith("level"):
-        drop_boxes(game["boxes"])
-        drop_ducks(game["used_ducks"])
-        if game["flight"]:
-            destroy_targets(game)
-            check_overlaps()
-            predict_collisions()
-            game["x"] += game["x_velocity"]
-            game["y"] += game["y_velocity"]
-            game["y_velocity"] -= GRAVITATIONAL_ACCEL
-            if abs(game["x_velocity"]) <= 1.5 and abs(game["y_velocity"]) <= 2.5:
-                game["slow_duck"] += elapsed
-            else:
-                game["slow_duck"] = 0
-            if game["y"] <= GROUND_LEVEL or game["slow_duck"] > 0.1:
-                game["used_ducks"].append({
-                    "x": game["x"],
-                    "y": game["y"],
-                    "w": game["w"],
-                    "h": game["h"],
-                    "vy": 0
-                })
-                initial_state()
-        else:
-            if not targets_remaining():
-                load_level(game["next_level"])
-            elif game["ducks"] == 0:
-                if game["level"].endswith(".json"):
-                    load_level(game["level"])
-                else:
-                    game["level"] = "lose"
+    if levels.is_playing(game["level"]):
+        time_step = 1 / PHYSICS_RATE
+        game["accumulator"] += min(elapsed, MAX_CATCH_UP)
+        while game["accumulator"] >= time_step and levels.is_playing(game["level"]):
+            tick()
+            game["accumulator"] -= time_step
+        audio.dispatch(mixer)
+        game["alpha"] = game["accumulator"] / time_step
+    else:
+        game["accumulator"] = 0.0
+    request_redraw()
+
+
+def request_redraw():
+    """
+    Asks for the window to be drawn again if the simulation has marked the
+    game dirty or anything is still moving, since the drawn positions are
+    interpolated between the steps. The profiling overlay is drawn every frame
+    while it's shown, so that it measures the frame rate.
+    """
+    moving = levels.is_playing(game["level"]) and (game["flight"] or game["previous"])
+    if game["dirty"] or moving or profile["enabled"]:
+        game["dirty"] = False
+        sweeperlib.request_redraw()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="A Wee Bit Miffed Ducks")
+    parser.add_argument("--levels", default=None,
+                        help="directory of normal levels to play instead of the game's own, "
+                             "e.g. a corpus written by validate.py")
+    options = parser.parse_args()
+    if options.levels is not None:
+        game["first_level"] = os.path.join(options.levels, FIRST_LEVEL)
+
+    # The levels that can be started from the menu
+    levels.preload(levels.cache, game["seed"], game["first_level"])
+    levels.preload(levels.cache, game["seed"], "level1")
     sweeperlib.load_duck("sprites")
     sweeperlib.create_window(width=WIN_WIDTH, height=WIN_HEIGHT)
     sweeperlib.set_draw_handler(draw_handler)
@@ -971,5 +502,7 @@ if __name__ == "__main__":
     sweeperlib.set_release_handler(mouse_release_handler)
     sweeperlib.set_keyboard_handler(keyboard_handler)
     sweeperlib.set_interval_handler(update, interval=1/60)
+    sweeperlib.set_render_on_change()
     initialize_extras()
     sweeperlib.start()
+    replay.save(recording, game, REPLAY_FILE)
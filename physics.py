@@ -0,0 +1,931 @@
+"""
+A Wee Bit Miffed Ducks: the simulation core.
+
+Everything that moves in the game is simulated here: the flying duck, used
+ducks falling down, boxes stacking on top of each other and the collisions
+between the duck and the boxes. This module doesn't import pyglet or
+sweeperlib, so the physics can be stepped without a window or audio device,
+e.g. when simulating lots of shots in worker processes.
+
+The state of the simulation is kept in a world dictionary created with
+`create_world`. The duck, the used ducks and the boxes in it are `Duck` and
+`Box` objects from the entities module. Things that the player should see or
+hear (a launch, a bounce, a broken box) are not played from here. Instead
+they are appended to the world's event list, which the rendering and audio
+layer empties with `pop_events` after each step.
+"""
+import math
+import random
+import spatial
+from entities import Duck, load_boxes
+
+
+WIN_WIDTH = 1920
+WIN_HEIGHT = 1080
+GROUND_LEVEL = 80
+LAUNCH_X = 100
+LAUNCH_Y = 100 + GROUND_LEVEL
+GRAVITATIONAL_ACCEL = 1.5
+FORCE_FACTOR = 0.6
+ELASTICITY = 0.5
+
+# The most ducks the player gets for a random level
+MAX_DUCKS = 16
+
+# Velocities and accelerations are given in pixels per tick at this rate. The
+# simulation can be stepped with a different time step; the movement is then
+# scaled to match.
+TICK_RATE = 60
+TIME_STEP = 1 / TICK_RATE
+
+
+############################## Math functions ##############################
+
+
+def calculate_distance(x1, y1, x2, y2):
+    """
+    Returns the distance between two points.
+
+    :Parameters:
+        `x1` : float
+            X-coordinate of the first point.
+        `y1` : float
+            Y-coordinate of the first point.
+        `x1` : float
+            X-coordinate of the second point.
+        `y1` : float
+            Y-coordinate of the second point.
+    """
+    return math.sqrt(pow(x2 - x1, 2) + pow(y2 - y1, 2))
+
+
+def calculate_angle(x1, y1, x2, y2):
+    """
+    Returns the radian angle between two points.
+
+    :Parameters:
+        `x1` : float
+            X-coordinate of the first point.
+        `y1` : float
+            Y-coordinate of the first point.
+        `x1` : float
+            X-coordinate of the second point.
+        `y1` : float
+            Y-coordinate of the second point.
+    """
+    x_distance = x2 - x1
+    y_distance = y2 - y1
+    return math.atan2(y_distance, x_distance)
+
+
+def convert_to_xy(angle, ray):
+    """
+    Converts polar coordinates to cartesian coordinates and returns them.
+
+    :Parameters:
+        `angle` : float
+            The radian angle from the reference angle.
+        `ray` : float
+            The distance from the reference point.
+    """
+    x = ray * math.cos(angle)
+    y = ray * math.sin(angle)
+    return x, y
+
+
+def clamp_inside_circle(x, y, circle_center_x, circle_center_y, radius):
+    """
+    First the function finds out whether the given
+    point is already inside the circle. If it is, its coordinates
+    are simply returned as they are. However, if the point is outside
+    the circle, it is "pulled" to the circle's perimeter and then returned.
+
+    :Parameters:
+        `x` : float
+            X-coordinate of the point.
+        `y` : float
+            Y-coordinate of the point.
+        `circle_center_x` : float
+            X-coordinate of the circle's center.
+        `circle_center_x` : float'
+            Y-coordinate of the circle's center.
+        `radius` : float
+            Radius of the circle.
+    """
+    distance = calculate_distance(x, y, circle_center_x, circle_center_y)
+    if distance > radius:
+        angle = calculate_angle(x, y, circle_center_x, circle_center_y)
+        ray = distance - radius
+        move_x, move_y = convert_to_xy(angle, ray)
+        return x + move_x, y + move_y
+    return x, y
+
+
+############################## World state ##############################
+
+
+def create_world(boxes=(), ducks=0):
+    """
+    Creates a new world dictionary. The duck is put into the launch position
+    and the given boxes are loaded into the world as `Box`es, so the caller's
+    list is never modified by the simulation. The boxes are also put into a spatial
+    grid which is used for all collision queries.
+
+    :Parameters:
+        `boxes` : A `list` of `dict`s that describe boxes.
+                  The dictionaries must have type, x, y, w, h and vy keys.
+        `ducks` : int
+            The number of ducks the player has left.
+    """
+    world = {
+        "duck": Duck(LAUNCH_X, LAUNCH_Y),
+        "angle": 0,
+        "force": 0,
+        "flight": False,
+        "ducks": ducks,
+        "used_ducks": [],
+        "awake_ducks": {},
+        "duck_grid": spatial.create_grid(),
+        "slow_duck": 0,
+        "events": [],
+        "previous_x": LAUNCH_X,
+        "previous_y": LAUNCH_Y,
+        "previous": {},
+        "moved": False,
+        "dirty": True
+    }
+    set_boxes(world, boxes)
+    return world
+
+
+def set_boxes(world, boxes):
+    """
+    Replaces the world's boxes with `Box`es loaded from the given boxes and
+    rebuilds the spatial grid. Each box gets its position in the given list
+    as its index. All boxes start out falling; they settle during the first
+    steps.
+
+    :Parameters:
+        `world` : A `dict` created with `create_world`.
+        `boxes` : A `list` of `dict`s that describe boxes.
+    """
+    use_boxes(world, *build_boxes(boxes))
+
+
+def build_boxes(boxes):
+    """
+    Loads `Box`es from the given boxes and puts them into a new spatial grid
+    without touching any world, and returns the list of boxes and the grid.
+    Loading the boxes of a big level takes a while, so it can be done ahead
+    of time, e.g. in a background thread, and the result put into a world
+    later with `use_boxes`.
+
+    :Parameters:
+        `boxes` : A `list` of `dict`s that describe boxes.
+    """
+    loaded = load_boxes(boxes)
+    return loaded, spatial.create_grid(loaded)
+
+
+def use_boxes(world, boxes, grid):
+    """
+    Replaces the world's boxes with boxes loaded with `build_boxes`. The
+    boxes are used as they are, so they must not be used in another world.
+
+    :Parameters:
+        `world` : A `dict` created with `create_world`.
+        `boxes` : A `list` of `Box`es returned by `build_boxes`.
+        `grid` : The spatial grid returned with them.
+    """
+    world["boxes"] = boxes
+    world["grid"] = grid
+    index_boxes(world)
+    world["previous"] = {}
+    world["awake_boxes"] = {id(box): box for box in world["boxes"]}
+    world["dirty"] = True
+
+
+def index_boxes(world):
+    """
+    Counts the world's boxes by type and records the position of each box in
+    the box list, so that boxes can be removed without searching the list.
+    The counts and positions are kept up to date by `remove_boxes`.
+
+    :Parameters:
+        `world` : A `dict` created with `create_world`.
+    """
+    world["box_slots"] = {id(box): i for i, box in enumerate(world["boxes"])}
+    world["box_counts"] = {"target": 0, "obstacle": 0}
+    for box in world["boxes"]:
+        world["box_counts"][box.type] += 1
+
+
+def copy_world(world):
+    """
+    Returns a copy of the world that can be stepped without affecting the
+    original. Unlike `create_world`, the boxes keep their velocities and
+    settled flags, so a world whose boxes have settled can be copied without
+    dropping them again. Pending events are not copied.
+
+    :Parameters:
+        `world` : A `dict` created with `create_world`.
+    """
+    copy = dict(world)
+    copy["duck"] = world["duck"].copy()
+    copy["boxes"] = [box.copy() for box in world["boxes"]]
+    copy["used_ducks"] = [duck.copy() for duck in world["used_ducks"]]
+    copy["duck_grid"] = spatial.create_grid(copy["used_ducks"])
+    copy["awake_ducks"] = {id(duck): duck for duck in copy["used_ducks"] if not duck.settled}
+    copy["grid"] = spatial.create_grid(copy["boxes"])
+    index_boxes(copy)
+    copy["awake_boxes"] = {id(box): box for box in copy["boxes"] if not box.settled}
+    copy["previous"] = {}
+    copy["events"] = []
+    return copy
+
+
+def pop_events(world):
+    """
+    Returns the events emitted since the previous call and empties the
+    world's event list. Events are tuples whose first item is the name of
+    the event: "launch", "bounce" or "box_broken". A "box_broken" event
+    also carries the destroyed box.
+
+    :Parameters:
+        `world` : A `dict` created with `create_world`.
+    """
+    events = world["events"]
+    world["events"] = []
+    return events
+
+
+def render_position(world, body, alpha):
+    """
+    Returns the position where a box or a used duck should be drawn when the
+    time since the latest step is the fraction alpha of the time step. The
+    position is interpolated between the body's positions before and after
+    the latest step, so that motion looks smooth even when the screen is
+    drawn at a different rate than the simulation is stepped.
+
+    :Parameters:
+        `world` : A `dict` created with `create_world`.
+        `body` : A `Box` or a used `Duck`.
+        `alpha` : float
+            How far from the previous step to the latest one, from 0 to 1.
+    """
+    previous_y = world["previous"].get(id(body))
+    if previous_y is None:
+        return body.x, body.y
+    return body.x, previous_y + (body.y - previous_y) * alpha
+
+
+def duck_render_position(world, alpha):
+    """
+    Returns the position where the flying duck should be drawn, interpolated
+    the same way as in `render_position`. A duck that isn't flying is drawn
+    where it is.
+
+    :Parameters:
+        `world` : A `dict` created with `create_world`.
+        `alpha` : float
+            How far from the previous step to the latest one, from 0 to 1.
+    """
+    duck = world["duck"]
+    if not world["flight"]:
+        return duck.x, duck.y
+    return (world["previous_x"] + (duck.x - world["previous_x"]) * alpha,
+            world["previous_y"] + (duck.y - world["previous_y"]) * alpha)
+
+
+############################## Game related auxiliary functions ##############################
+
+
+def order_by_height(box):
+    """
+    Used to sort the list of boxes according to their height measured from the top of the box.
+
+    :Parameters:
+        `box` : A `Box`.
+    """
+    return box.y + box.h
+
+
+def update_position(world):
+    """Updates the duck's position when using arrow keys to adjust angle and force."""
+    duck = world["duck"]
+    x, y = convert_to_xy(math.radians(world["angle"]), world["force"])
+    duck.x = LAUNCH_X - x
+    duck.y = LAUNCH_Y - y
+    world["dirty"] = True
+
+
+def targets_remaining(world):
+    """Checks if there are any targets left in the list of boxes."""
+    return world["box_counts"]["target"] > 0
+
+
+def is_inside_area(min_x, max_x, min_y, max_y, box):
+    """
+    Checks whether the `box` is inside the area defined
+    by the minimum and maximum x and y values.
+
+    :Parameters:
+        `min_x` : float
+            Minimum x value of the area.
+        `max_x` : float
+            Maximum x value of the area.
+        `min_y` : float
+            Minimum y value of the area.
+        `max_y` : float
+            Maximum y value of the area.
+        `box` : A `Box`.
+    """
+    if max_y < box.y or min_y > box.y + box.h:
+        return False
+    if max_x < box.x or min_x > box.x + box.w:
+        return False
+    return True
+
+
+def initial_state(world):
+    """
+    Puts the game back into its initial state: the duck is put back into the
+    launch position, its speed to zero, and its flight state to False.
+    """
+    duck = world["duck"]
+    duck.x = LAUNCH_X
+    duck.y = LAUNCH_Y
+    world["angle"] = 0
+    world["force"] = 0
+    duck.x_velocity = 0
+    duck.y_velocity = 0
+    world["flight"] = False
+    world["dirty"] = True
+
+
+def launch(world):
+    """
+    Launches a duck and calculates its starting velocity. Stores x- and y-velocity
+    components to the world dictionary. Removes one duck.
+    """
+    duck = world["duck"]
+    if not world["flight"]:
+        duck.x_velocity = world["force"] * FORCE_FACTOR * math.cos(math.radians(world["angle"]))
+        duck.y_velocity = world["force"] * FORCE_FACTOR * math.sin(math.radians(world["angle"]))
+        world["flight"] = True
+        world["ducks"] -= 1
+        world["previous_x"] = duck.x
+        world["previous_y"] = duck.y
+        world["events"].append(("launch",))
+        world["dirty"] = True
+
+
+def create_boxes(quantity, rng=random):
+    """
+    Creates a speficied number of boxes with random positions inside the specified
+    area. Boxes are represented as dictionaries with the following keys:
+    type: either "target" or "obstacle"
+    x: x coordinate of the bottom left corner
+    y: y coordinate of the bottom left corner
+    w: box width
+    h: box height
+    vy: falling velocity of the box
+    To make the random levels easier to pass, the target boxes are
+    spawned higher than obstacles.
+
+    :Parameters:
+        `quantity` : int
+            The number of boxes to create. Preferably an even number.
+        `rng` : A `random.Random` instance used for the positions, so that a
+                level can be recreated from a seed. Defaults to the
+                `random` module.
+    """
+    boxlist = []
+    for i in range(quantity):
+        if i < quantity / 2:
+            box = {
+                "type": "target",
+                "x": rng.randint(WIN_WIDTH - 880, WIN_WIDTH - 60),
+                "y": rng.randint(340, 600),
+                "w": 40,
+                "h": 40,
+                "vy": 0
+            }
+        else:
+            box = {
+                "type": "obstacle",
+                "x": rng.randint(WIN_WIDTH - 880, WIN_WIDTH - 60),
+                "y": rng.randint(80, 300),
+                "w": 40,
+                "h": 40,
+                "vy": 0
+            }
+        boxlist.append(box)
+    boxlist.sort(key=lambda box: box["y"] + box["h"])
+
+    return boxlist
+
+
+############################## Simulation ##############################
+
+
+def find_support(world, box, new_y):
+    """
+    Finds what the box would be resting on if it moved down to new_y.
+    Only boxes below the box can support it: boxes whose bottom is lower, or
+    settled boxes at the same height. Boxes that only touch the box's side
+    don't count.
+
+    :Parameters:
+        `world` : A `dict` created with `create_world`.
+        `box` : A `Box`.
+        `new_y` : float
+            The y coordinate the box is about to move to.
+    :Returns:
+        The y coordinate of the highest supporting top, or `None` if nothing
+        would support the box.
+    """
+    support = None
+    for other in spatial.query(world["grid"],
+                               box.x,
+                               box.x + box.w,
+                               new_y,
+                               box.y + box.h):
+        if other is box:
+            continue
+        if other.x >= box.x + box.w or other.x + other.w <= box.x:
+            continue
+        if other.y > box.y or other.y == box.y and not other.settled:
+            continue
+        top = other.y + other.h
+        if top >= new_y and (support is None or top > support):
+            support = top
+    return support
+
+
+def wake_box(world, box):
+    """
+    Marks a settled box as falling so that drop_boxes moves it again.
+
+    :Parameters:
+        `world` : A `dict` created with `create_world`.
+        `box` : A `Box`.
+    """
+    if box.settled:
+        box.settled = False
+        world["awake_boxes"][id(box)] = box
+
+
+def wake_boxes_above(world, box):
+    """
+    Wakes the boxes that are resting on the box. Called when the box is
+    destroyed or starts to fall.
+
+    :Parameters:
+        `world` : A `dict` created with `create_world`.
+        `box` : A `Box`.
+    """
+    top = box.y + box.h
+    for other in spatial.query(world["grid"], box.x, box.x + box.w, top, top):
+        if other is not box and other.y > box.y:
+            wake_box(world, other)
+
+
+def drop_boxes(world, dt=TIME_STEP):
+    """
+    Drops the world's boxes for one time step. Each box is a `Box` with x
+    and y coordinates, width, height, falling velocity and a settled flag.
+
+    Only the boxes that are not settled are processed, lowest first, so a
+    stack that is resting on the ground costs nothing until something under
+    it is destroyed. What a falling box lands on is looked up from the
+    spatial grid under the box. Used ducks that the box moves past are woken.
+
+    Boxes that are spawned overlapping each other, as random levels can be,
+    may settle in a different order than they did before the settled flags
+    were added, so such a level can end up stacked differently. The stacks
+    are valid either way, and levels without overlaps settle the same.
+
+    :Parameters:
+        `world` : A `dict` created with `create_world`.
+        `dt` : float
+            The length of the time step in seconds.
+    """
+    awake = world["awake_boxes"]
+    if not awake:
+        return
+    units = dt * TICK_RATE
+    for box in sorted(awake.values(), key=lambda box: box.y):
+        world["previous"][id(box)] = box.y
+        velocity = box.vy + GRAVITATIONAL_ACCEL * units
+        new_y = box.y - velocity * units
+        support = find_support(world, box, new_y)
+        if support is None and new_y <= GROUND_LEVEL:
+            support = GROUND_LEVEL
+        if support is None:
+            wake_boxes_above(world, box)
+            box.vy = velocity
+            box.y = new_y
+        else:
+            if support != box.y:
+                wake_boxes_above(world, box)
+            box.y = support
+            box.vy = 0
+            box.settled = True
+            del awake[id(box)]
+        old_y = world["previous"][id(box)]
+        if box.y != old_y:
+            spatial.move_box(world["grid"], box)
+            wake_ducks(world,
+                       box.x,
+                       box.x + box.w,
+                       min(box.y, old_y),
+                       max(box.y, old_y) + box.h)
+
+
+def add_used_duck(world, duck):
+    """
+    Leaves a duck in the world as a used duck. It falls until it lands.
+
+    :Parameters:
+        `world` : A `dict` created with `create_world`.
+        `duck` : A used `Duck`.
+    """
+    duck.settled = False
+    world["used_ducks"].append(duck)
+    world["awake_ducks"][id(duck)] = duck
+    spatial.insert_box(world["duck_grid"], duck)
+    world["dirty"] = True
+
+
+def clear_used_ducks(world):
+    """Removes all used ducks from the world."""
+    world["used_ducks"] = []
+    world["awake_ducks"] = {}
+    world["duck_grid"] = spatial.create_grid()
+    world["dirty"] = True
+
+
+def wake_ducks(world, min_x, max_x, min_y, max_y):
+    """
+    Wakes the resting used ducks that are inside the area defined by the
+    minimum and maximum x and y values. Called when a box in the area moves
+    or is destroyed, since the ducks may have to fall or destroy the box.
+    """
+    for duck in spatial.query(world["duck_grid"], min_x, max_x, min_y, max_y):
+        if duck.settled:
+            duck.settled = False
+            world["awake_ducks"][id(duck)] = duck
+
+
+def drop_ducks(world, dt=TIME_STEP):
+    """
+    Makes used ducks fall down and destroy targets.
+
+    A duck that neither moved nor destroyed anything during a step goes to
+    sleep and costs nothing until a box under it or overlapping it moves or
+    is destroyed (see `wake_ducks`).
+
+    :Parameters:
+        `world` : A `dict` created with `create_world`.
+        `dt` : float
+            The length of the time step in seconds.
+    """
+    awake = world["awake_ducks"]
+    if not awake:
+        return
+    units = dt * TICK_RATE
+    for duck in list(awake.values()):
+        y = duck.y
+        targets = world["box_counts"]["target"]
+        destroy_targets(world, duck)
+        if duck.y <= GROUND_LEVEL:
+            duck.y = GROUND_LEVEL
+        else:
+            below = spatial.query(world["grid"],
+                                  duck.x,
+                                  duck.x + duck.w,
+                                  duck.y,
+                                  duck.y + duck.h)
+            if below:
+                # Land on the highest box the duck overlaps
+                duck.y = max(box.y + box.h for box in below)
+                duck.y_velocity = 0
+            else:
+                world["previous"][id(duck)] = duck.y
+                duck.y_velocity -= GRAVITATIONAL_ACCEL * units
+                duck.y += duck.y_velocity * units
+        if duck.y != y:
+            spatial.move_box(world["duck_grid"], duck)
+            world["dirty"] = True
+        elif world["box_counts"]["target"] == targets:
+            duck.settled = True
+            del awake[id(duck)]
+
+
+def remove_boxes(world, boxes):
+    """
+    Removes the given boxes from the world and wakes the boxes that were
+    resting on them. Emits a "box_broken" event for each box.
+
+    A removed box is replaced in the box list by the last box of the list, so
+    removing doesn't have to shift or copy the list. The order of the boxes
+    doesn't matter to the simulation.
+
+    :Parameters:
+        `world` : A `dict` created with `create_world`.
+        `boxes` : A `list` of `Box`es.
+    """
+    all_boxes = world["boxes"]
+    slots = world["box_slots"]
+    for box in boxes:
+        slot = slots.pop(id(box), None)
+        if slot is None:
+            continue
+        last = all_boxes.pop()
+        if last is not box:
+            all_boxes[slot] = last
+            slots[id(last)] = slot
+        world["box_counts"][box.type] -= 1
+        spatial.remove_box(world["grid"], box)
+        world["awake_boxes"].pop(id(box), None)
+        wake_boxes_above(world, box)
+        wake_ducks(world, box.x, box.x + box.w, box.y, box.y + box.h)
+        world["events"].append(("box_broken", box))
+        world["dirty"] = True
+
+
+def destroy_targets(world, duck):
+    """
+    Destroys targets that are overlapping the duck.
+
+    :Parameters:
+        `world` : A `dict` created with `create_world`.
+        `duck` : A `Duck`.
+    """
+    remove_boxes(world, [box for box in spatial.query(world["grid"],
+                                                      duck.x,
+                                                      duck.x + duck.w,
+                                                      duck.y,
+                                                      duck.y + duck.h)
+                         if box.type == "target"])
+
+
+def sweep_axis(position, movement, box_min, box_max):
+    """
+    Returns the times at which a point moving along one axis enters and
+    exits the range from box_min to box_max. Time 0 is the current position
+    and time 1 is after the whole movement. If the point doesn't move, it is
+    either always inside the range or never, and touching the range's ends
+    doesn't count as being inside.
+
+    :Parameters:
+        `position` : float
+            The starting position of the point.
+        `movement` : float
+            How much the point moves during the time unit.
+        `box_min` : float
+            The start of the range.
+        `box_max` : float
+            The end of the range.
+    """
+    if movement == 0:
+        if box_min < position < box_max:
+            return -math.inf, math.inf
+        return math.inf, -math.inf
+    first = (box_min - position) / movement
+    second = (box_max - position) / movement
+    if first < second:
+        return first, second
+    return second, first
+
+
+def time_of_impact(duck, x_movement, y_movement, box):
+    """
+    Calculates when the duck moving by the given amounts during one time
+    unit first touches the box, and which side of the box it hits. The
+    duck's rectangle is swept against the box, so the contact is found even
+    if the duck would move past the whole box within the time unit.
+
+    :Parameters:
+        `duck` : A `Duck`.
+        `x_movement` : float
+            How much the duck moves along the x axis.
+        `y_movement` : float
+            How much the duck moves along the y axis.
+        `box` : A `Box`.
+    :Returns:
+        A tuple (time, normal_x, normal_y) where time is between 0 and 1 and
+        the normal points out of the side of the box that was hit, e.g.
+        (0, 1) for the top. Returns `None` if the duck doesn't touch the box
+        during the time unit, or if it is already inside the box.
+    """
+    x_entry, x_exit = sweep_axis(duck.x,
+                                 x_movement,
+                                 box.x - duck.w,
+                                 box.x + box.w)
+    y_entry, y_exit = sweep_axis(duck.y,
+                                 y_movement,
+                                 box.y - duck.h,
+                                 box.y + box.h)
+    entry = max(x_entry, y_entry)
+    exit_ = min(x_exit, y_exit)
+    if entry >= exit_ or entry < 0 or entry > 1:
+        return None
+    if x_entry > y_entry:
+        return entry, -math.copysign(1, x_movement), 0
+    return entry, 0, -math.copysign(1, y_movement)
+
+
+def bounce(world, box, normal_x, normal_y):
+    """
+    Bounces the duck off a side of the box. The duck is put against the side
+    and the velocity towards the box is reversed and damped by the elasticity.
+    Hitting the top or the bottom also slows the duck down horizontally.
+
+    :Parameters:
+        `world` : A `dict` created with `create_world`.
+        `box` : A `Box`.
+        `normal_x` : int
+            1 for the right side of the box, -1 for the left side, 0 otherwise.
+        `normal_y` : int
+            1 for the top of the box, -1 for the bottom, 0 otherwise.
+    """
+    duck = world["duck"]
+    if normal_x > 0:
+        duck.x = box.x + box.w
+    elif normal_x < 0:
+        duck.x = box.x - duck.w
+    if normal_y > 0:
+        duck.y = box.y + box.h
+    elif normal_y < 0:
+        duck.y = box.y - duck.h
+    if normal_x and duck.x_velocity * normal_x < 0:
+        duck.x_velocity = duck.x_velocity * -ELASTICITY
+    if normal_y and duck.y_velocity * normal_y < 0:
+        duck.y_velocity = duck.y_velocity * -ELASTICITY
+        duck.x_velocity = duck.x_velocity * ELASTICITY
+    if abs(duck.x_velocity) > 1 or abs(duck.y_velocity) > 2:
+        world["events"].append(("bounce",))
+
+
+def move_duck(world, dt=TIME_STEP, max_bounces=4):
+    """
+    Moves the flying duck by its velocity for one time step. The duck is
+    swept through the boxes in its path: it destroys the targets it passes
+    and stops exactly at the first obstacle it hits, bounces off it and
+    continues for the rest of the time step. At most max_bounces bounces
+    are resolved per time step, after which the duck stays against the last
+    obstacle it hit.
+
+    :Parameters:
+        `world` : A `dict` created with `create_world`.
+        `dt` : float
+            The length of the time step in seconds.
+        `max_bounces` : int
+            The maximum number of bounces per time step.
+    """
+    duck = world["duck"]
+    remaining = dt * TICK_RATE
+    for _ in range(max_bounces + 1):
+        x_movement = duck.x_velocity * remaining
+        y_movement = duck.y_velocity * remaining
+        contact = None
+        passed = []
+        for box in spatial.query(world["grid"],
+                                 duck.x + min(x_movement, 0),
+                                 duck.x + duck.w + max(x_movement, 0),
+                                 duck.y + min(y_movement, 0),
+                                 duck.y + duck.h + max(y_movement, 0)):
+            impact = time_of_impact(duck, x_movement, y_movement, box)
+            if impact is None:
+                continue
+            if box.type == "target":
+                passed.append((impact[0], box))
+            elif contact is None or impact[0] < contact[0]:
+                contact = (impact[0], box, impact[1], impact[2])
+
+        time = 1.0 if contact is None else contact[0]
+        remove_boxes(world, [box for impact_time, box in passed if impact_time <= time])
+        duck.x += x_movement * time
+        duck.y += y_movement * time
+        if contact is None:
+            return
+        bounce(world, contact[1], contact[2], contact[3])
+        remaining *= 1 - time
+
+
+def check_overlaps(world):
+    """
+    Checks if the duck is currently inside an obstacle, e.g. because a box
+    fell on it. If it is, the duck is pushed out through the side of the
+    obstacle that is closest to it, skipping sides that are blocked by other
+    obstacles, and bounces off that side.
+
+    :Parameters:
+        `world` : A `dict` created with `create_world`.
+    """
+    duck = world["duck"]
+    obstacles = [box for box in spatial.query(world["grid"],
+                                              duck.x,
+                                              duck.x + duck.w,
+                                              duck.y,
+                                              duck.y + duck.h)
+                 if box.type == "obstacle" and
+                 box.x < duck.x + duck.w and duck.x < box.x + box.w and
+                 box.y < duck.y + duck.h and duck.y < box.y + box.h]
+    if not obstacles:
+        return
+    # Push out of the lowest obstacle
+    box = min(obstacles, key=order_by_height)
+
+    # Distance to move the duck out through each side, up first on ties
+    sides = [
+        (box.y + box.h - duck.y, 0, 1),
+        (box.x + box.w - duck.x, 1, 0),
+        (duck.x + duck.w - box.x, -1, 0),
+        (duck.y + duck.h - box.y, 0, -1)
+    ]
+    sides.sort(key=lambda side: side[0])
+    for distance, normal_x, normal_y in sides:
+        x = duck.x + normal_x * distance
+        y = duck.y + normal_y * distance
+        blocked = False
+        for other in spatial.query(world["grid"], x, x + duck.w, y, y + duck.h):
+            if (other is not box and other.type == "obstacle" and
+                    other.x < x + duck.w and x < other.x + other.w and
+                    other.y < y + duck.h and y < other.y + other.h):
+                blocked = True
+                break
+        if not blocked:
+            bounce(world, box, normal_x, normal_y)
+            return
+    bounce(world, box, 0, 1)
+
+
+def fly_duck(world, dt=TIME_STEP):
+    """
+    Moves the flying duck for one time step. The duck destroys the targets it
+    hits and bounces off obstacles. When the duck hits the ground or has been
+    nearly stationary for a while, it is left in the world as a used duck and
+    a new duck is put into the launch position.
+
+    :Parameters:
+        `world` : A `dict` created with `create_world`.
+        `dt` : float
+            The length of the time step in seconds.
+    """
+    duck = world["duck"]
+    world["previous_x"] = duck.x
+    world["previous_y"] = duck.y
+    destroy_targets(world, duck)
+    check_overlaps(world)
+    move_duck(world, dt)
+    duck.y_velocity -= GRAVITATIONAL_ACCEL * dt * TICK_RATE
+    if abs(duck.x_velocity) <= 1.5 and abs(duck.y_velocity) <= 2.5:
+        world["slow_duck"] += dt
+    else:
+        world["slow_duck"] = 0
+    if duck.y <= GROUND_LEVEL or world["slow_duck"] > 0.1:
+        add_used_duck(world, Duck(duck.x, duck.y, duck.w, duck.h))
+        initial_state(world)
+
+
+def step(world, dt=TIME_STEP, lap=None):
+    """
+    Advances the world by one time step: drops the boxes and the used ducks
+    and moves the flying duck, if there is one. The game steps the world
+    with a fixed dt, which keeps the simulation the same regardless of how
+    fast the screen is drawn.
+
+    If anything moved during the step or the step before it, the world's
+    "dirty" flag is set, so the game knows to draw it again. The extra step
+    makes sure the bodies that just stopped are drawn where they came to
+    rest instead of between their last two positions. The flag is also set when the duck is aimed, launched or
+    reset, when a box is removed or a used duck added, and when boxes or used
+    ducks are replaced; whoever draws the world clears it.
+
+    :Parameters:
+        `world` : A `dict` created with `create_world`.
+        `dt` : float
+            The length of the time step in seconds.
+        `lap` : A function that is called with the name of each phase of the
+                step ("drop_boxes", "drop_ducks", "fly_duck") after it, e.g.
+                for timing the phases. Optional.
+    """
+    world["previous"] = {}
+    flying = world["flight"]
+    drop_boxes(world, dt)
+    if lap:
+        lap("drop_boxes")
+    drop_ducks(world, dt)
+    if lap:
+        lap("drop_ducks")
+    if flying:
+        fly_duck(world, dt)
+        if lap:
+            lap("fly_duck")
+    moved = flying or bool(world["previous"])
+    if moved or world["moved"]:
+        world["dirty"] = True
+    world["moved"] = moved
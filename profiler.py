@@ -0,0 +1,131 @@
+"""
+Per-phase timings of the game's physics ticks and drawn frames, kept in a
+ring buffer of the latest records and dumped to CSV.
+"""
+import collections
+import csv
+import time
+
+# How many ticks and frames are kept
+BUFFER_SIZE = 1200
+
+
+def create_profiler(size=BUFFER_SIZE):
+    """
+    Creates a profiler. It's disabled until its "enabled" key is set to True;
+    until then `begin`, `lap` and `end` don't record anything.
+
+    :Parameters:
+        `size` : int
+            How many of the latest ticks and frames are kept.
+    """
+    return {
+        "enabled": False,
+        "records": collections.deque(maxlen=size),
+        "current": None,
+        "previous_lap": 0.0
+    }
+
+
+def begin(profiler, kind):
+    """
+    Starts timing a tick or a frame.
+
+    :Parameters:
+        `profiler` : A `dict` created with `create_profiler`.
+        `kind` : str
+            What is being timed, "tick" or "frame".
+    """
+    if not profiler["enabled"]:
+        return
+    now = time.perf_counter()
+    profiler["current"] = {"kind": kind, "start": now}
+    profiler["previous_lap"] = now
+
+
+def lap(profiler, phase):
+    """
+    Records the time since the previous lap (or the beginning) as the time
+    of the given phase. Time recorded for the same phase is added up.
+
+    :Parameters:
+        `profiler` : A `dict` created with `create_profiler`.
+        `phase` : str
+            Name of the phase that just ended.
+    """
+    if not profiler["enabled"] or profiler["current"] is None:
+        return
+    now = time.perf_counter()
+    current = profiler["current"]
+    current[phase] = current.get(phase, 0.0) + (now - profiler["previous_lap"]) * 1000
+    profiler["previous_lap"] = now
+
+
+def end(profiler):
+    """
+    Finishes the tick or frame being timed and adds it to the records. A
+    record is a dictionary with the kind ("tick" or "frame"), the start time
+    in seconds, and the total time and the time of each phase in
+    milliseconds.
+
+    :Parameters:
+        `profiler` : A `dict` created with `create_profiler`.
+    """
+    if not profiler["enabled"] or profiler["current"] is None:
+        return
+    current = profiler["current"]
+    current["total"] = (time.perf_counter() - current["start"]) * 1000
+    profiler["records"].append(current)
+    profiler["current"] = None
+
+
+def recent(profiler, kind, seconds=1.0):
+    """
+    Returns the records of the given kind that started during the latest
+    seconds, oldest first.
+
+    :Parameters:
+        `profiler` : A `dict` created with `create_profiler`.
+        `kind` : str
+            "tick" or "frame".
+        `seconds` : float
+            How far back to look.
+    """
+    since = time.perf_counter() - seconds
+    found = []
+    for record in reversed(profiler["records"]):
+        if record["start"] < since:
+            break
+        if record["kind"] == kind:
+            found.append(record)
+    found.reverse()
+    return found
+
+
+def average(records, phase="total"):
+    """Returns the average time of the phase in the records, in milliseconds."""
+    if not records:
+        return 0.0
+    return sum(record.get(phase, 0.0) for record in records) / len(records)
+
+
+def dump(profiler, path):
+    """
+    Writes the records into a CSV file, one row per tick or frame, oldest
+    first. Phases that a record doesn't have are left empty.
+
+    :Parameters:
+        `profiler` : A `dict` created with `create_profiler`.
+        `path` : str
+            Path to the file.
+    """
+    records = list(profiler["records"])
+    fields = ["kind", "start", "total"]
+    for record in records:
+        for phase in record:
+            if phase not in fields:
+                fields.append(phase)
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fields)
+        writer.writeheader()
+        writer.writerows(records)
@@ -0,0 +1,166 @@
+"""
+Recording and playing back games. A replay is the run's seed and the
+commands the player gave, each marked with the tick it was given on, so
+playing it back goes through exactly the same simulation as the original
+run. Play a replay back headlessly, as fast as possible:
+
+    python replay.py replay.json
+
+Only the commands that change the simulation are recorded: loading a level,
+going to the menu, and launching a duck from the position it was aimed at.
+Aiming itself doesn't change anything until the duck is launched.
+
+Replays are saved as JSON:
+
+    {"version": 1, "seed": 1234, "rate": 60, "ticks": 845,
+     "events": [[0, "load", "level1.json"], [310, "launch", 60, 150, 45, 55], ...],
+     "result": {...}}
+
+"result" is a summary of the state at the end of the run, used to check
+that the playback ended up in the same state.
+"""
+import argparse
+import json
+import time
+import physics
+import levels
+
+VERSION = 1
+
+
+def create_replay(seed, rate):
+    """
+    Creates an empty replay for a run.
+
+    :Parameters:
+        `seed` : int
+            The seed of the run.
+        `rate` : int
+            Physics steps per second.
+    """
+    return {
+        "version": VERSION,
+        "seed": seed,
+        "rate": rate,
+        "ticks": 0,
+        "events": []
+    }
+
+
+def apply_command(game, command):
+    """
+    Carries out a command in the game. The game uses this for the player's
+    input, so the recorded commands have the same effect when played back.
+
+    :Parameters:
+        `game` : A `dict` created with levels.create_game.
+        `command` : A `tuple` whose first item is the command's name:
+                    ("load", level), ("menu",) or
+                    ("launch", x, y, angle, force).
+    """
+    name = command[0]
+    if name == "load":
+        physics.initial_state(game)
+        levels.load_level(game, command[1])
+    elif name == "menu":
+        physics.initial_state(game)
+        game["level"] = "menu"
+    elif name == "launch":
+        game["duck"].x, game["duck"].y, game["angle"], game["force"] = command[1:]
+        physics.launch(game)
+    else:
+        raise ValueError("Unknown command: {}".format(name))
+
+
+def record(recording, game, command):
+    """
+    Carries out a command in the game and adds it to the replay.
+
+    :Parameters:
+        `recording` : A `dict` created with `create_replay`.
+        `game` : A `dict` created with levels.create_game.
+        `command` : A command `tuple`, see `apply_command`.
+    """
+    recording["events"].append([game["ticks"]] + list(command))
+    apply_command(game, command)
+
+
+def summary(game):
+    """Returns a dictionary that describes the end state of a run."""
+    return {
+        "ticks": game["ticks"],
+        "level": game["level"],
+        "boxes": [[box.type, box.x, box.y] for box in game["boxes"]],
+        "used_ducks": [[duck.x, duck.y] for duck in game["used_ducks"]],
+        "ducks": game["ducks"]
+    }
+
+
+def save(recording, game, path):
+    """
+    Saves the replay into a file, along with a summary of the game's state.
+
+    :Parameters:
+        `recording` : A `dict` created with `create_replay`.
+        `game` : A `dict` created with levels.create_game.
+        `path` : str
+            Path to the file.
+    """
+    recording["ticks"] = game["ticks"]
+    recording["result"] = summary(game)
+    with open(path, "w") as file:
+        json.dump(recording, file, separators=(",", ":"))
+
+
+def load(path):
+    """
+    Loads a replay from a file.
+
+    :Parameters:
+        `path` : str
+            Path to the file.
+    """
+    with open(path) as file:
+        recording = json.load(file)
+    if recording.get("version") != VERSION:
+        raise ValueError("Unsupported replay version: {}".format(recording.get("version")))
+    return recording
+
+
+def play(recording):
+    """
+    Plays a replay back without a window and returns the game state at the
+    end. The commands are carried out on the ticks they were recorded on.
+
+    :Parameters:
+        `recording` : A `dict` created with `create_replay` or `load`.
+    """
+    game = levels.create_game(recording["seed"])
+    dt = 1 / recording["rate"]
+    for tick, *command in recording["events"] + [[recording["ticks"]]]:
+        while game["ticks"] < tick:
+            if not levels.is_playing(game["level"]):
+                raise ValueError("The replay doesn't match the simulation "
+                                 "at tick {}".format(game["ticks"]))
+            levels.advance(game, dt)
+        if command:
+            apply_command(game, command)
+    return game
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plays a replay back headlessly.")
+    parser.add_argument("replay", help="a replay file")
+    args = parser.parse_args()
+
+    replay_data = load(args.replay)
+    start = time.perf_counter()
+    end_state = play(replay_data)
+    elapsed = time.perf_counter() - start
+    print("{} ticks in {:.2f} s, {:.0f}x real time".format(
+        end_state["ticks"], elapsed, end_state["ticks"] / replay_data["rate"] / elapsed))
+    if "result" in replay_data:
+        if summary(end_state) == replay_data["result"]:
+            print("The playback ended in the recorded state")
+        else:
+            print("The playback DIFFERS from the recorded state")
@@ -0,0 +1,152 @@
+"""
+A cache of shot outcomes, so that a shot that has already been simulated in
+the same state of a level doesn't have to be simulated again, e.g. when a
+level is restarted or solved repeatedly.
+
+An outcome is stored under the shot's key: a digest of the state of the
+level's boxes and used ducks and of the duck's slow time (see `state_key`)
+and the shot's parameters, e.g. the angle and the force. The digest covers
+everything that affects how a shot plays out, so a cached outcome is exactly
+what simulating the shot again would give. Since the same world can be asked
+about many shots, the digest is computed once per world with `state_key` and
+passed to `shot_key`.
+
+The cache keeps the most recently used outcomes and counts its hits and
+misses, see `stats`. It isn't thread-safe; each thread or process should use
+its own cache.
+
+The solver uses the cache (see solver.cached_shot). The aiming preview and
+replay.py don't. The preview is computed on every frame drawn while aiming,
+and once a level has a few hundred boxes, digesting its state costs more
+than computing the preview, so looking the preview up would be slower than
+computing it. A replay has to simulate every step to check that the run
+ends in the recorded state.
+"""
+import collections
+import hashlib
+import struct
+
+# How many shot outcomes are kept
+CACHE_SIZE = 65536
+
+BOX = struct.Struct("<6dq?")
+DUCK = struct.Struct("<5d?")
+TYPE_CODES = {"target": 0.0, "obstacle": 1.0}
+
+
+def create_cache(size=CACHE_SIZE):
+    """
+    Creates an empty shot cache.
+
+    :Parameters:
+        `size` : int
+            The most outcomes kept; the least recently used is dropped first.
+    """
+    return {
+        "size": size,
+        "entries": collections.OrderedDict(),
+        "hits": 0,
+        "misses": 0
+    }
+
+
+def state_key(world):
+    """
+    Returns a digest of the state of the world's boxes and used ducks: their
+    order, types, positions, sizes, velocities and settled flags, and the
+    indices of the boxes. The time the duck has been nearly stationary
+    ("slow_duck") is included too, since it carries over from the previous
+    shot and decides when a slow duck is retired. Two worlds with the same
+    digest play every shot the same way.
+
+    :Parameters:
+        `world` : A `dict` created with physics.create_world.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(struct.pack("<2qd",
+                              len(world["boxes"]),
+                              len(world["used_ducks"]),
+                              world["slow_duck"]))
+    for box in world["boxes"]:
+        digest.update(BOX.pack(TYPE_CODES[box.type],
+                               box.x,
+                               box.y,
+                               box.w,
+                               box.h,
+                               box.vy,
+                               box.index,
+                               box.settled))
+    for duck in world["used_ducks"]:
+        digest.update(DUCK.pack(duck.x,
+                                duck.y,
+                                duck.w,
+                                duck.h,
+                                duck.y_velocity,
+                                duck.settled))
+    return digest.digest()
+
+
+def shot_key(state, *parameters):
+    """
+    Returns the cache key of a shot.
+
+    :Parameters:
+        `state` : The world's digest from `state_key`.
+        `parameters` : The shot's parameters, e.g. the angle, the force and
+                       the most steps simulated.
+    """
+    return (state,) + parameters
+
+
+def lookup(cache, key):
+    """
+    Returns the outcome stored under the key, or `None` if there isn't one,
+    and counts the hit or the miss. The outcome is shared with the cache and
+    must not be modified.
+
+    :Parameters:
+        `cache` : A `dict` created with `create_cache`.
+        `key` : A key from `shot_key`.
+    """
+    entries = cache["entries"]
+    outcome = entries.get(key)
+    if outcome is None:
+        cache["misses"] += 1
+        return None
+    entries.move_to_end(key)
+    cache["hits"] += 1
+    return outcome
+
+
+def store(cache, key, outcome):
+    """
+    Stores an outcome under the key and drops the least recently used
+    outcomes that don't fit.
+
+    :Parameters:
+        `cache` : A `dict` created with `create_cache`.
+        `key` : A key from `shot_key`.
+        `outcome` : The outcome, e.g. a result dictionary from the solver.
+    """
+    entries = cache["entries"]
+    entries[key] = outcome
+    entries.move_to_end(key)
+    while len(entries) > cache["size"]:
+        entries.popitem(last=False)
+
+
+def stats(cache):
+    """
+    Returns a dictionary with the number of hits, misses and stored
+    outcomes, and the hit rate (hits per lookup, 0 before any lookups).
+
+    :Parameters:
+        `cache` : A `dict` created with `create_cache`.
+    """
+    lookups = cache["hits"] + cache["misses"]
+    return {
+        "hits": cache["hits"],
+        "misses": cache["misses"],
+        "size": len(cache["entries"]),
+        "hit_rate": cache["hits"] / lookups if lookups else 0.0
+    }
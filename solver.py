@@ -0,0 +1,281 @@
+"""
+A headless solver that tries every shot the player can aim with the keyboard
+and reports which targets each shot destroys. Used for checking that levels
+can be passed. Run from the command line:
+
+    python solver.py level1.json
+    python solver.py --seed 42 --boxes 20
+
+The shots are simulated with the physics module in a pool of worker
+processes. Every worker settles the level once and then simulates its shots
+on copies of the settled world.
+"""
+import argparse
+import multiprocessing
+import random
+import time
+import levelfile
+import physics
+import shotcache
+
+# The angles and forces that the arrow keys can set
+ANGLES = tuple(range(-175, 185, 5))
+FORCES = tuple(range(5, 105, 5))
+
+# A shot that takes longer than this many steps is cut short
+MAX_STEPS = 1200
+
+# The settled world of the level the worker process is solving
+_worker = {
+    "world": None,
+    "record_path": False
+}
+
+
+def candidate_shots(angles=ANGLES, forces=FORCES):
+    """
+    Returns a list of all (angle, force) pairs made of the given angles and
+    forces.
+
+    :Parameters:
+        `angles` : A sequence of angles in degrees.
+        `forces` : A sequence of forces.
+    """
+    return [(angle, force) for angle in angles for force in forces]
+
+
+def level_boxes(level=None, seed=None, quantity=None):
+    """
+    Returns the boxes of a level, either read from a level file or created
+    with physics.create_boxes from a seed.
+
+    :Parameters:
+        `level` : str
+            Path to a level file such as "level1.json" or "level1.lvl".
+        `seed` : int
+            Seed for the random level, used if no level file is given.
+        `quantity` : int
+            The number of boxes in the random level.
+    """
+    if level is not None:
+        return levelfile.load(level)["boxes"]
+    return physics.create_boxes(quantity, random.Random(seed))
+
+
+def settle(boxes, max_steps=MAX_STEPS):
+    """
+    Creates a world with the given boxes and steps it until all boxes have
+    settled. Each box keeps its position in the given list as its index, so
+    that the results can refer to them.
+
+    :Parameters:
+        `boxes` : A `list` of `dict`s that describe boxes.
+        `max_steps` : int
+            The most steps to wait for the boxes to settle.
+    """
+    world = physics.create_world(boxes)
+    wait_until_still(world, max_steps)
+    return world
+
+
+def wait_until_still(world, max_steps=MAX_STEPS):
+    """
+    Steps the world until the boxes and the used ducks have stopped falling
+    and returns the number of steps taken.
+
+    :Parameters:
+        `world` : A `dict` created with `physics.create_world`.
+        `max_steps` : int
+            The most steps to wait.
+    """
+    steps = 0
+    while steps < max_steps and (world["awake_boxes"] or world["awake_ducks"]):
+        physics.step(world)
+        steps += 1
+    physics.pop_events(world)
+    return steps
+
+
+def simulate_shot(world, angle, force, max_steps=MAX_STEPS, record_path=False):
+    """
+    Simulates one shot from the launch position until the duck lands and
+    returns a result dictionary with the following keys:
+    angle, force: the shot
+    destroyed: indices of the targets the shot destroyed, in order
+    cleared: True if no targets are left once the used duck has come to rest
+    steps: how many steps the duck flew
+    rest_steps: how many more steps it took for everything to come to rest
+    path: the duck's position after each step, if record_path is True
+
+    The world isn't modified; the shot is simulated on a copy.
+
+    :Parameters:
+        `world` : A world `dict` created with `settle`.
+        `angle` : float
+            The launch angle in degrees.
+        `force` : float
+            The launch force.
+        `max_steps` : int
+            The most steps the duck can fly before the shot is cut short.
+        `record_path` : bool
+            Whether the duck's path is recorded.
+    """
+    return play_shot(physics.copy_world(world), angle, force, max_steps, record_path)
+
+
+def cached_shot(cache, world, angle, force, max_steps=MAX_STEPS, state=None):
+    """
+    Same as `simulate_shot` with the path recorded, but the result is taken
+    from a shot cache if the shot has already been simulated in the same
+    state, and stored there otherwise. The result is shared with the cache
+    and must not be modified.
+
+    :Parameters:
+        `cache` : A `dict` created with shotcache.create_cache.
+        `world` : A world `dict` created with `settle`.
+        `angle` : float
+            The launch angle in degrees.
+        `force` : float
+            The launch force.
+        `max_steps` : int
+            The most steps the duck can fly before the shot is cut short.
+        `state` : The world's digest from shotcache.state_key. Computed if
+                  not given; pass it when simulating many shots in the same
+                  world.
+    """
+    if state is None:
+        state = shotcache.state_key(world)
+    key = shotcache.shot_key(state, angle, force, max_steps)
+    result = shotcache.lookup(cache, key)
+    if result is None:
+        result = simulate_shot(world, angle, force, max_steps, record_path=True)
+        shotcache.store(cache, key, result)
+    return result
+
+
+def play_shot(world, angle, force, max_steps=MAX_STEPS, record_path=False):
+    """
+    Same as `simulate_shot`, but the shot is played in the given world, which
+    is left as it is when the duck has landed and come to rest. The used duck
+    can still destroy targets while it falls into place, so the world is
+    stepped until it rests before the remaining targets are counted.
+    """
+    world["angle"] = angle
+    world["force"] = force
+    world["ducks"] += 1
+    physics.update_position(world)
+    physics.launch(world)
+    steps = 0
+    destroyed = []
+    path = []
+    while world["flight"] and steps < max_steps:
+        physics.step(world)
+        steps += 1
+        destroyed.extend(_destroyed_targets(world))
+        if record_path:
+            # A landed duck has been put back to the launch position
+            duck = world["duck"] if world["flight"] else world["used_ducks"][-1]
+            path.append((duck.x, duck.y))
+    rest_steps = 0
+    while (world["awake_ducks"] or world["awake_boxes"]) and rest_steps < max_steps:
+        physics.step(world)
+        rest_steps += 1
+        destroyed.extend(_destroyed_targets(world))
+    result = {
+        "angle": angle,
+        "force": force,
+        "destroyed": destroyed,
+        "cleared": not physics.targets_remaining(world),
+        "steps": steps,
+        "rest_steps": rest_steps
+    }
+    if record_path:
+        result["path"] = path
+    return result
+
+
+def _destroyed_targets(world):
+    """Returns the indices of the targets destroyed since the last call."""
+    return [event[1].index for event in physics.pop_events(world) if event[0] == "box_broken"]
+
+
+def _start_worker(boxes, record_path=False):
+    """Settles the level once in each worker process."""
+    _worker["world"] = settle(boxes)
+    _worker["record_path"] = record_path
+
+
+def _simulate_worker_shot(shot):
+    """Simulates a shot in the worker's settled world."""
+    angle, force = shot
+    return simulate_shot(_worker["world"], angle, force, record_path=_worker["record_path"])
+
+
+def solve(boxes, shots=None, processes=None, chunksize=16, cache=None):
+    """
+    Simulates the given shots in a level and returns a list of result
+    dictionaries in the same order as the shots (see `simulate_shot`).
+
+    With a shot cache, the shots found in the cache aren't simulated again,
+    and the rest are simulated with their paths recorded and stored in the
+    cache (see `cached_shot`).
+
+    :Parameters:
+        `boxes` : A `list` of `dict`s that describe the level's boxes.
+        `shots` : A `list` of (angle, force) pairs. Defaults to every shot
+                  that can be aimed with the keyboard.
+        `processes` : int
+            The number of worker processes. Defaults to the number of CPUs.
+            With 1, the shots are simulated in this process.
+        `chunksize` : int
+            How many shots are sent to a worker at a time.
+        `cache` : A `dict` created with shotcache.create_cache. Optional.
+    """
+    if shots is None:
+        shots = candidate_shots()
+    if cache is None:
+        if processes == 1:
+            world = settle(boxes)
+            return [simulate_shot(world, angle, force) for angle, force in shots]
+        with multiprocessing.Pool(processes, _start_worker, (boxes,)) as pool:
+            return pool.map(_simulate_worker_shot, shots, chunksize)
+
+    world = settle(boxes)
+    state = shotcache.state_key(world)
+    keys = [shotcache.shot_key(state, angle, force, MAX_STEPS) for angle, force in shots]
+    results = [shotcache.lookup(cache, key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if processes == 1:
+        simulated = [simulate_shot(world, *shots[i], record_path=True) for i in missing]
+    elif missing:
+        with multiprocessing.Pool(processes, _start_worker, (boxes, True)) as pool:
+            simulated = pool.map(_simulate_worker_shot, [shots[i] for i in missing], chunksize)
+    else:
+        simulated = []
+    for i, result in zip(missing, simulated):
+        shotcache.store(cache, keys[i], result)
+        results[i] = result
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Finds the shots that clear a level.")
+    parser.add_argument("level", nargs="?", help="a level file, e.g. level1.json")
+    parser.add_argument("--seed", type=int, default=0, help="seed for a random level")
+    parser.add_argument("--boxes", type=int, default=20, help="boxes in a random level")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes")
+    args = parser.parse_args()
+
+    level_box_list = level_boxes(args.level, args.seed, args.boxes)
+    start = time.perf_counter()
+    shot_results = solve(level_box_list, processes=args.processes)
+    elapsed = time.perf_counter() - start
+    targets = sum(1 for box in level_box_list if box["type"] == "target")
+    best = max(shot_results, key=lambda result: len(result["destroyed"]))
+    for shot_result in shot_results:
+        if shot_result["cleared"]:
+            print("Clears the level: angle {angle}, force {force}".format(**shot_result))
+    print("Best shot destroys {} of {} targets: angle {}, force {}".format(
+        len(best["destroyed"]), targets, best["angle"], best["force"]))
+    print("{} shots in {:.2f} s, {:.0f} shots/s".format(
+        len(shot_results), elapsed, len(shot_results) / elapsed))
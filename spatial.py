@@ -0,0 +1,146 @@
+"""
+A uniform grid for finding the boxes near an area without going through
+every box in the world.
+
+The grid is a dictionary that maps cell coordinates to the boxes whose area
+touches the cell. The cell size defaults to the size of a box (40 pixels), so
+a box touches at most four cells and a query only has to look at the few
+cells under the queried area. The grid must be kept up to date by the code
+that moves, adds or removes boxes: call `move_box` after changing a box's
+position, and `insert_box`/`remove_box` when the box appears or disappears.
+
+Boxes are objects with x, y, w and h attributes, e.g. `entities.Box` or
+`entities.Duck`, and they are identified by their identity, so two boxes with
+equal values are still separate boxes.
+"""
+
+CELL_SIZE = 40
+
+
+def create_grid(boxes=(), cell_size=CELL_SIZE):
+    """
+    Creates a grid and inserts the given boxes into it.
+
+    :Parameters:
+        `boxes` : A `list` of objects with x, y, w and h attributes.
+        `cell_size` : float
+            The width and height of one grid cell.
+    """
+    grid = {
+        "cell_size": cell_size,
+        "cells": {},
+        "boxes": {}
+    }
+    for box in boxes:
+        insert_box(grid, box)
+    return grid
+
+
+def cell_range(grid, min_x, max_x, min_y, max_y):
+    """
+    Returns the first and the last column and row of the cells that are
+    touched by the area defined by the minimum and maximum x and y values.
+    The area's edges count as touching, same as in physics.is_inside_area.
+    """
+    size = grid["cell_size"]
+    return (int(min_x // size), int(max_x // size),
+            int(min_y // size), int(max_y // size))
+
+
+def box_cells(grid, box):
+    """Returns a tuple of the cells that the box touches."""
+    first_col, last_col, first_row, last_row = cell_range(grid,
+                                                          box.x,
+                                                          box.x + box.w,
+                                                          box.y,
+                                                          box.y + box.h)
+    return tuple((col, row)
+                 for col in range(first_col, last_col + 1)
+                 for row in range(first_row, last_row + 1))
+
+
+def insert_box(grid, box):
+    """
+    Adds a box into the grid.
+
+    :Parameters:
+        `grid` : A `dict` created with `create_grid`.
+        `box` : An object with x, y, w and h attributes.
+    """
+    cells = box_cells(grid, box)
+    grid["boxes"][id(box)] = (box, cells)
+    for cell in cells:
+        grid["cells"].setdefault(cell, {})[id(box)] = box
+
+
+def remove_box(grid, box):
+    """
+    Removes a box from the grid. Removing a box that isn't in the grid does
+    nothing.
+
+    :Parameters:
+        `grid` : A `dict` created with `create_grid`.
+        `box` : An object with x, y, w and h attributes.
+    """
+    entry = grid["boxes"].pop(id(box), None)
+    if entry is None:
+        return
+    for cell in entry[1]:
+        members = grid["cells"][cell]
+        del members[id(box)]
+        if not members:
+            del grid["cells"][cell]
+
+
+def move_box(grid, box):
+    """
+    Updates the cells of a box after its position or size has changed.
+    Nothing is done if the box still touches the same cells.
+
+    :Parameters:
+        `grid` : A `dict` created with `create_grid`.
+        `box` : An object with x, y, w and h attributes.
+    """
+    entry = grid["boxes"].get(id(box))
+    if entry is None:
+        insert_box(grid, box)
+        return
+    if box_cells(grid, box) != entry[1]:
+        remove_box(grid, box)
+        insert_box(grid, box)
+
+
+def query(grid, min_x, max_x, min_y, max_y):
+    """
+    Returns a list of the boxes that are inside the area defined by the
+    minimum and maximum x and y values. Touching the area's edge counts as
+    being inside, same as in physics.is_inside_area.
+
+    :Parameters:
+        `grid` : A `dict` created with `create_grid`.
+        `min_x` : float
+            Minimum x value of the area.
+        `max_x` : float
+            Maximum x value of the area.
+        `min_y` : float
+            Minimum y value of the area.
+        `max_y` : float
+            Maximum y value of the area.
+    """
+    first_col, last_col, first_row, last_row = cell_range(grid, min_x, max_x, min_y, max_y)
+    cells = grid["cells"]
+    found = {}
+    for col in range(first_col, last_col + 1):
+        for row in range(first_row, last_row + 1):
+            members = cells.get((col, row))
+            if not members:
+                continue
+            for key, box in members.items():
+                if key in found:
+                    continue
+                if max_y < box.y or min_y > box.y + box.h:
+                    continue
+                if max_x < box.x or min_x > box.x + box.w:
+                    continue
+                found[key] = box
+    return list(found.values())
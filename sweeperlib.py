@@ -27,6 +27,8 @@ if modifiers & sweeperlib.MOD_SHIFT:
     # somethinghappens
 """
 
+import os
+import threading
 import pyglet
 from pyglet.gl import glEnable, GL_TEXTURE_2D
 
@@ -48,10 +50,23 @@ graphics = {
     "background": None,
     "bg_color": None,
     "batch": None,
-    "sprites": [],
-    "images": {}
+    "sprites": {},
+    "free_sprites": [],
+    "frame": 0,
+    "anonymous_sprites": 0,
+    "text_batch": None,
+    "labels": {},
+    "text_frame": 0,
+    "images": {},
+    "atlas": None,
+    "sprite_path": None,
+    "loading_background": None,
+    "render_on_change": False
 }
 
+# How many unused text labels are kept around for reuse
+MAX_HIDDEN_LABELS = 100
+
 handlers = {
     "timeouts": [],
 }
@@ -98,11 +113,51 @@ def load_duck(path):
     :param str path: path to the sprites folder
     """
 
-    pyglet.resource.path = [path]
-    duck = pyglet.resource.image("duck.png")
-    sling = pyglet.resource.image("sling.png")
-    graphics["images"]["duck"] = duck
-    graphics["images"]["sling"] = sling
+    load_images({"duck": "duck.png", "sling": "sling.png"}, path)
+
+def load_images(names, path=None):
+    """
+    Loads more images into the sprite dictionary. All images are packed into
+    one shared texture atlas, so that drawing sprites of different images
+    doesn't require switching textures. The images should be small; large
+    images like backgrounds can be loaded with load_background.
+
+    :param dict names: image keys mapped to file names
+    :param str path: path to the sprites folder, defaults to the folder used
+                     in the previous call
+    """
+
+    if path is None:
+        path = graphics["sprite_path"]
+    graphics["sprite_path"] = path
+    if graphics["atlas"] is None:
+        graphics["atlas"] = pyglet.image.atlas.TextureBin()
+    for key, name in names.items():
+        image = pyglet.image.load(os.path.join(path, name))
+        graphics["images"][key] = graphics["atlas"].add(image, border=1)
+
+def load_background(name, path=None):
+    """
+    Starts loading an image to be used as the window's background. Decoding
+    a large image can take seconds, so it is done in a separate thread and
+    the background color is drawn until the image is ready. This way the
+    window can be shown right away.
+
+    :param str name: file name of the image
+    :param str path: path to the sprites folder, defaults to the folder used
+                     in load_images
+    """
+
+    if path is None:
+        path = graphics["sprite_path"]
+    loading = {"image": None}
+
+    def decode():
+        loading["image"] = pyglet.image.load(os.path.join(path, name))
+        request_redraw()
+
+    graphics["loading_background"] = loading
+    threading.Thread(target=decode, daemon=True).start()
 
 def create_window(width=800, height=600, bg_color=(240, 240, 240, 255)):
     """
@@ -304,12 +359,92 @@ def set_interval_handler(handler, interval=1/60):
     pyglet.clock.schedule_interval(handler, interval)
     handlers["timeouts"].append(handler)
 
+def set_render_on_change(enabled=True):
+    """
+    Sets the window to be drawn only when its contents have changed, instead
+    of on every iteration of the game loop. This saves a lot of work when
+    nothing on the screen moves, e.g. in a menu. The window is drawn again
+    after input (key presses and mouse buttons and dragging), after it has
+    been resized or uncovered, and after request_redraw has been called.
+    Anything else that changes what's on the screen, e.g. an animation in the
+    interval handler, must call request_redraw.
+
+    Needs to be called before start. Only works with pyglet 1.x, whose game
+    loop draw_changed_windows replaces; with pyglet 2 the window keeps being
+    drawn all the time.
+
+    :param bool enabled: whether the window is only drawn when it changes
+    """
+
+    if not graphics["window"]:
+        print("Window hasn't been created!")
+        return
+    if enabled and not pyglet.version.startswith("1."):
+        print("Render on change needs pyglet 1.x!")
+        return
+    if enabled and not graphics["render_on_change"]:
+        graphics["window"].push_handlers(**{
+            event: invalidate_window for event in (
+                "on_key_press",
+                "on_mouse_press",
+                "on_mouse_release",
+                "on_mouse_drag",
+                "on_resize",
+                "on_expose",
+                "on_show"
+            )
+        })
+    elif not enabled and graphics["render_on_change"]:
+        graphics["window"].pop_handlers()
+    graphics["render_on_change"] = enabled
+
+def invalidate_window(*args):
+    """
+    Event handler that marks the window to be drawn again. Used by
+    set_render_on_change; the event is passed on to the game's own handler.
+    """
+
+    request_redraw()
+
+def request_redraw():
+    """
+    Tells the game loop that the window's contents have changed and it needs
+    to be drawn again. Only needed with set_render_on_change; otherwise the
+    window is drawn all the time anyway. Can be called from any thread.
+    """
+
+    if graphics["window"]:
+        graphics["window"].invalid = True
+
+def draw_changed_windows():
+    """
+    Replaces the game loop's idle step when render on change is set. Calls the
+    interval handlers like the default step does, but only draws the windows
+    that have been marked with request_redraw, whereas the default draws
+    every window whenever any interval handler has been called.
+
+    :return: seconds until the next interval handler is due
+    """
+
+    loop = pyglet.app.event_loop
+    loop.clock.call_scheduled_functions(loop.clock.update_time())
+    for window in pyglet.app.windows:
+        if window.invalid:
+            # Cleared before drawing, so the draw handler can ask for another
+            window.invalid = False
+            window.switch_to()
+            window.dispatch_event("on_draw")
+            window.flip()
+    return loop.clock.get_sleep_time(True)
+
 def start():
     """
     Starts the game. You need to create a window and set handlers before
     calling this.
     """
 
+    if graphics["render_on_change"]:
+        pyglet.app.event_loop.idle = draw_changed_windows
     pyglet.app.run()
 
 def close():
@@ -339,6 +474,11 @@ def draw_background():
     this before anything else, otherwise the bg color will cover everything.
     """
 
+    loading = graphics["loading_background"]
+    if loading is not None and loading["image"] is not None:
+        # Textures can only be created in the main thread
+        graphics["background"] = pyglet.sprite.Sprite(loading["image"].get_texture())
+        graphics["loading_background"] = None
     graphics["background"].draw()
 
 def draw_text(text, x, y, color=(0, 0, 0, 255), font="serif", size=32):
@@ -349,7 +489,10 @@ def draw_text(text, x, y, color=(0, 0, 0, 255), font="serif", size=32):
     optional arguments. The x and y coordinates define the bottom left corner
     of the text.
     
-    Text, if any, should be drawn last.
+    Text, if any, should be drawn last. The text is actually drawn by
+    draw_sprites (or draw_prepared_text) on top of the sprites. Labels are
+    kept between frames, so writing the same text to the same place every
+    frame is cheap.
     
     :param str text: string to display
     :param int x: bottom left x coordinate for the text
@@ -359,27 +502,81 @@ def draw_text(text, x, y, color=(0, 0, 0, 255), font="serif", size=32):
     :param int size: fontin size as points
     """
 
-    text_box = pyglet.text.Label(text,
-        font_name=font,
-        font_size=size,
-        color=color,
-        x=x, y=y,
-        anchor_x="left", anchor_y="bottom"
-    )
-    text_box.draw()
+    if graphics["text_batch"] is None:
+        graphics["text_batch"] = pyglet.graphics.Batch()
+    frame = graphics["text_frame"]
+    labels = graphics["labels"].setdefault((text, font, size, tuple(color)), [])
+    free = None
+    for entry in labels:
+        if entry[1] == frame:
+            continue
+        free = entry
+        if entry[0].x == x and entry[0].y == y:
+            break
+    if free is None:
+        labels.append([pyglet.text.Label(text,
+            font_name=font,
+            font_size=size,
+            color=color,
+            x=x, y=y,
+            anchor_x="left", anchor_y="bottom",
+            batch=graphics["text_batch"]
+        ), frame])
+        return
+    label = free[0]
+    free[1] = frame
+    if label.x != x or label.y != y:
+        label.position = (x, y)
+    if not label.visible:
+        label.visible = True
+
+def draw_prepared_text():
+    """
+    Draws the text written with draw_text since the previous call. Text that
+    wasn't written again is hidden, and the oldest hidden labels are deleted
+    if there are too many of them. draw_sprites calls this, so there's no
+    need to call it separately when drawing sprites.
+    """
+
+    if graphics["text_batch"] is None:
+        return
+    frame = graphics["text_frame"]
+    hidden = []
+    for key, labels in graphics["labels"].items():
+        for entry in labels:
+            if entry[1] != frame:
+                if entry[0].visible:
+                    entry[0].visible = False
+                hidden.append((entry[1], key, entry))
+    if len(hidden) > MAX_HIDDEN_LABELS:
+        hidden.sort(key=lambda item: item[0])
+        for _, key, entry in hidden[:len(hidden) - MAX_HIDDEN_LABELS]:
+            entry[0].delete()
+            graphics["labels"][key].remove(entry)
+            if not graphics["labels"][key]:
+                del graphics["labels"][key]
+    graphics["text_batch"].draw()
+    graphics["text_frame"] += 1
 
 def begin_sprite_draw():
     """
-    Starts the drawing of sprites (tiles) by initializing a batch where all
-    sprites to be drawn are collected. Sprites are not drawn one by one because
-    that is not particularly efficient. Instead, they are smartly collected to
-    a batch that is then drawn in one go. In order for this to work, this
-    function must be called before drawing the sprites themselves.
+    Starts the drawing of sprites (tiles). Sprites are not drawn one by one
+    because that is not particularly efficient. Instead, they are smartly
+    collected to a batch that is then drawn in one go. In order for this to
+    work, this function must be called before drawing the sprites themselves.
+
+    The batch and the sprites in it are kept from one frame to the next:
+    a sprite is only created the first time it's prepared, and after that
+    it's just moved. This makes drawing lots of sprites every frame a lot
+    cheaper.
     """
 
-    graphics["batch"] = pyglet.graphics.Batch()
+    if graphics["batch"] is None:
+        graphics["batch"] = pyglet.graphics.Batch()
+    graphics["frame"] += 1
+    graphics["anonymous_sprites"] = 0
 
-def prepare_sprite(key, x, y):
+def prepare_sprite(key, x, y, owner=None):
     """
     Adds a sprite to be drawn into the batch. Therefore the begin_sprite_draw
     must have been called once before this function is called. The first
@@ -390,26 +587,57 @@ def prepare_sprite(key, x, y):
     You have to calculate the position of each tile. One tile sprite is always
     40x40 pixels.
 
+    The owner identifies the thing the sprite is drawn for, e.g. a tile or a
+    box, so that the same sprite can be reused for it in every frame. If no
+    owner is given, sprites are reused in the order they are prepared. A
+    sprite whose owner isn't prepared during a frame is hidden and recycled
+    for other owners.
+
     :param str key: key, used to select the sprite
     :param int x: bottom left x coordinate
     :param int y: bottom left y coordinate
-    """
-
-    graphics["sprites"].append(pyglet.sprite.Sprite(
-        graphics["images"][str(key).lower()],
-        x,
-        y,
-        batch=graphics["batch"]
-    ))
+    :param owner: any hashable value identifying the sprite's owner
+    """
+
+    if owner is None:
+        owner = ("anonymous", graphics["anonymous_sprites"])
+        graphics["anonymous_sprites"] += 1
+    image = graphics["images"][str(key).lower()]
+    entry = graphics["sprites"].get(owner)
+    if entry is None:
+        if graphics["free_sprites"]:
+            sprite = graphics["free_sprites"].pop()
+            sprite.image = image
+            sprite.position = (x, y)
+            sprite.visible = True
+        else:
+            sprite = pyglet.sprite.Sprite(image, x, y, batch=graphics["batch"])
+        graphics["sprites"][owner] = [sprite, graphics["frame"]]
+        return
+    sprite = entry[0]
+    entry[1] = graphics["frame"]
+    if sprite.image is not image:
+        sprite.image = image
+    if sprite.x != x or sprite.y != y:
+        sprite.position = (x, y)
 
 def draw_sprites():
     """
-    Draws all prepared sprites from the batch in one go. Call this function
-    when you have prepared all sprites to be drawn.
+    Draws all prepared sprites from the batch in one go, and then the text
+    written with draw_text. Call this function when you have prepared all
+    sprites to be drawn. Sprites that weren't prepared during this frame are
+    hidden and put aside for reuse.
     """
 
+    sprites = graphics["sprites"]
+    frame = graphics["frame"]
+    unused = [owner for owner, entry in sprites.items() if entry[1] != frame]
+    for owner in unused:
+        sprite = sprites.pop(owner)[0]
+        sprite.visible = False
+        graphics["free_sprites"].append(sprite)
     graphics["batch"].draw()
-    graphics["sprites"].clear()
+    draw_prepared_text()
 
 if __name__ == "__main__":
     # Disabling two pylint warnings because it would complain about the test
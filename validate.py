@@ -0,0 +1,193 @@
+"""
+Generates random levels from a seed, checks that each of them can be passed
+with the ducks the game gives for it and writes the passable ones to a
+directory as level files. Run from the command line:
+
+    python validate.py --seed 42 --levels 8 --out corpus
+
+A level is checked by playing it greedily: every shot is tried on the current
+state of the level, the one that destroys the most targets is played, and
+this is repeated until the level is cleared or the ducks run out. A level
+that the greedy player can't pass is rejected, even though a smarter player
+might pass it. The levels are checked in parallel in worker processes.
+
+The levels are created with levels.create_level, the same way as the game
+creates the random levels of a run with the same seed. The same seed always
+produces the same levels and the same verdicts, no matter how many processes
+are used.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import levelfile
+import levels
+import physics
+import solver
+
+
+def validate_level(seed, number, shots):
+    """
+    Plays a random level greedily and returns a dictionary with the
+    following keys:
+    number: the level's number
+    boxes: the level's boxes before they have fallen
+    ducks: the number of ducks the game gives for the level
+    solution: the (angle, force) pairs that were played
+    passed: True if the level was cleared with the ducks
+    ticks: the number of physics steps simulated
+
+    :Parameters:
+        `seed` : int
+            The seed of the run.
+        `number` : int
+            The level's number, starting from 1.
+        `shots` : A `list` of (angle, force) pairs to try for each duck.
+    """
+    boxes = levels.create_level(seed, number)
+    ducks = min(len(boxes), physics.MAX_DUCKS)
+    world = physics.create_world(boxes)
+    ticks = solver.wait_until_still(world)
+    solution = []
+    while physics.targets_remaining(world) and len(solution) < ducks:
+        results = [solver.simulate_shot(world, angle, force) for angle, force in shots]
+        ticks += sum(result["steps"] + result["rest_steps"] for result in results)
+        best = max(results, key=lambda result: (result["cleared"], len(result["destroyed"])))
+        if not best["destroyed"]:
+            break
+        played = solver.play_shot(world, best["angle"], best["force"])
+        ticks += played["steps"] + played["rest_steps"]
+        solution.append((best["angle"], best["force"]))
+    return {
+        "number": number,
+        "boxes": boxes,
+        "ducks": ducks,
+        "solution": solution,
+        "passed": not physics.targets_remaining(world),
+        "ticks": ticks
+    }
+
+
+def _validate_worker_level(job):
+    """Validates one level in a worker process."""
+    return validate_level(*job)
+
+
+def validate_levels(seed, count, shots=None, processes=None):
+    """
+    Validates the random levels from 1 to count in parallel and returns a
+    list of the results of `validate_level`, in level order.
+
+    :Parameters:
+        `seed` : int
+            The seed of the run.
+        `count` : int
+            The number of levels.
+        `shots` : A `list` of (angle, force) pairs to try for each duck.
+                  Defaults to every shot that can be aimed with the keyboard.
+        `processes` : int
+            The number of worker processes. Defaults to the number of CPUs.
+    """
+    if shots is None:
+        shots = solver.candidate_shots()
+    jobs = [(seed, number, shots) for number in range(1, count + 1)]
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(_validate_worker_level, jobs, 1)
+
+
+def existing_levels(directory):
+    """
+    Returns the names of the level files in the directory, or an empty list
+    if the directory doesn't exist.
+
+    :Parameters:
+        `directory` : str
+            Path to the directory.
+    """
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory) if levelfile.is_level_file(name))
+
+
+def write_corpus(results, seed, directory):
+    """
+    Writes the passed levels into the directory as level files that the game
+    can play with `python main.py --levels <directory>`. The files are named
+    in play order, level1.json, level2.json and so on, whatever the numbers
+    of the passed random levels were, so the chain always starts from
+    level1.json. The levels are chained with their next_level keys, which
+    name the next file in the same directory, and the last one leads to the
+    win screen. The seed, the random level's number and the found solution
+    are saved too.
+
+    Raises FileExistsError if the directory already has level files, so that
+    the game's own levels or an earlier corpus are never overwritten or mixed
+    in.
+
+    :Parameters:
+        `results` : A `list` of results from `validate_level`.
+        `seed` : int
+            The seed of the run.
+        `directory` : str
+            Path to the directory. Created if it doesn't exist.
+    """
+    if existing_levels(directory):
+        raise FileExistsError("{} already has level files".format(directory))
+    os.makedirs(directory, exist_ok=True)
+    passed = [result for result in results if result["passed"]]
+    names = ["level{}.json".format(i + 1) for i in range(len(passed))]
+    paths = [os.path.join(directory, name) for name in names]
+    for i, result in enumerate(passed):
+        data = {
+            "boxes": result["boxes"],
+            "ducks": result["ducks"],
+            "next_level": names[i + 1] if i + 1 < len(names) else "win",
+            "seed": seed,
+            "number": result["number"],
+            "solution": result["solution"]
+        }
+        with open(paths[i], "w") as file:
+            json.dump(data, file, indent=4)
+    return paths
+
+
+def positive_int(text):
+    """Parses a command line argument that must be a positive integer."""
+    value = int(text)
+    if value <= 0:
+        raise argparse.ArgumentTypeError("must be a positive integer: {}".format(text))
+    return value
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates and validates random levels.")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the run")
+    parser.add_argument("--levels", type=int, default=8, help="number of levels")
+    parser.add_argument("--out", default="corpus", help="directory for the passed levels")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes")
+    parser.add_argument("--angle-step", type=positive_int, default=5, help="degrees between tried angles")
+    parser.add_argument("--force-step", type=positive_int, default=5, help="difference of tried forces")
+    args = parser.parse_args()
+    if existing_levels(args.out):
+        parser.error("{} already has level files, use an empty directory".format(args.out))
+
+    worker_count = args.processes or os.cpu_count()
+    # The same ranges as solver.ANGLES and solver.FORCES, with the given steps
+    shot_list = solver.candidate_shots(range(-175, 181, args.angle_step),
+                                       range(args.force_step, 101, args.force_step))
+    start = time.perf_counter()
+    level_results = validate_levels(args.seed, args.levels, shot_list, worker_count)
+    elapsed = time.perf_counter() - start
+    written = write_corpus(level_results, args.seed, args.out)
+
+    for level_result in level_results:
+        print("level {:>3}: {} in {} of {} ducks".format(
+            level_result["number"],
+            "passed" if level_result["passed"] else "REJECTED",
+            len(level_result["solution"]),
+            level_result["ducks"]))
+    total_ticks = sum(level_result["ticks"] for level_result in level_results)
+    print("{} of {} levels written to {}".format(len(written), args.levels, args.out))
+    print("{:.2f} levels/s, {:.0f} ticks/s, {:.0f} ticks/s per core ({} processes)".format(
+        args.levels / elapsed, total_ticks / elapsed, total_ticks / elapsed / worker_count, worker_count))